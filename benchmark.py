@@ -0,0 +1,237 @@
+"""
+Measure the throughput of training, sampling, repairing and reading data on a synthetic dataset and a randomly
+initialized model, so it runs anywhere (CPU only is fine) without 'data_1' or a trained model. The results are saved
+as json and compared with a baseline saved by '--save-baseline', a regression makes the exit code 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import cv2
+import tensorflow as tf
+import config
+import cly_dcgan as GAN
+import evaluate
+import image_util
+import repair
+import sample
+
+# the results are higher-is-better throughputs
+UNITS = {
+    'train_steps_per_sec': 'steps/s',
+    'train_images_per_sec': 'images/s',
+    'sample_images_per_sec': 'images/s',
+    'repair_iterations_per_sec': 'iterations/s',
+    'repair_images_per_sec': 'images/s',
+    'decode_images_per_sec': 'images/s',
+    'resize_images_per_sec': 'images/s',
+    'pack_images_per_sec': 'images/s',
+}
+
+
+def make_dataset(path, num, height, width):
+    """
+    write random images as jpg
+    :param path: the directory of images
+    :param num: the number of images
+    :param height: the height of images
+    :param width: the width of images
+    :return:
+    """
+    os.makedirs(path, exist_ok=True)
+    random = np.random.RandomState(0)
+    for i in range(num):
+        # smooth images are more like photos than white noise for jpg
+        img = random.randint(0, 256, size=(height // 8, width // 8, GAN.image_depth)).astype(np.uint8)
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_LINEAR)
+        cv2.imwrite(os.path.join(path, '{}.jpg'.format(i)), img)
+
+
+def make_model(index):
+    """
+    save a randomly initialized G as 'model-(index)' in 'model_path'
+    :param index: the index of model
+    :return:
+    """
+    with tf.Graph().as_default():
+        noise = tf.placeholder(tf.float32, [None, GAN.noise_size])
+        GAN.get_generator(noise, False, False)
+        saver = tf.train.Saver()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.save(sess, image_util.model_path + 'model', global_step=index)
+
+
+def bench_ingest(root, num):
+    """
+    the throughput of decoding ('get_imgs'), resizing ('change_imgs_size') and packing ('get_dataset') images
+    """
+    results = {}
+    image_util.read_path = os.path.join(root, 'raw/')
+    image_util.save_path = os.path.join(root, 'resized/')
+    os.makedirs(image_util.save_path)
+    make_dataset(image_util.read_path, num, 256, 256)
+
+    begin = time.time()
+    image_util.get_imgs(num)
+    results['decode_images_per_sec'] = num / (time.time() - begin)
+
+    begin = time.time()
+    image_util.change_imgs_size()
+    results['resize_images_per_sec'] = min(num, 1000) / (time.time() - begin)
+
+    begin = time.time()
+    image_util.get_dataset(num)
+    results['pack_images_per_sec'] = num / (time.time() - begin)
+    return results
+
+
+def bench_train(root, num, epochs):
+    """
+    the throughput of training steps in 'cly_dcgan.train', summed from the phases of each step in metrics, so the
+    setup and the work after epochs (sampling, writing, saving, scoring) are not counted
+    """
+    image_util.read_path = os.path.join(root, 'data/')
+    make_dataset(image_util.read_path, num, GAN.image_height, GAN.image_width)
+    GAN.epochs = epochs
+    GAN.print_every = 1e9
+    GAN.n_samples = 0
+    # only the model of epoch 0 is saved
+    GAN.break_time = epochs + 1
+    evaluate.eval_every = 0
+    with tf.Graph().as_default():
+        GAN.train()
+
+    with open(os.path.join(GAN.log_path, 'metrics.jsonl')) as f:
+        steps = [json.loads(line) for line in f]
+    # the first step warms up
+    steps = [record for record in steps if record['type'] == 'step'][1:]
+    seconds = sum(record['time'].get(phase, 0.0) for record in steps
+                  for phase in ('data', 'd_step', 'g_step', 'gd_step'))
+    return {'train_steps_per_sec': len(steps) / seconds,
+            'train_images_per_sec': len(steps) * GAN.batch_size / seconds}
+
+
+def bench_sample(root, num, batch):
+    """
+    the throughput of the frozen G
+    """
+    sample.export(0, os.path.join(root, 'generator.pb'))
+    sess, noise, samples = sample.load_frozen(os.path.join(root, 'generator.pb'))
+    with sess:
+        batch_noise = np.random.uniform(-1, 1, size=(batch, GAN.noise_size))
+        sess.run(samples, feed_dict={noise: batch_noise})
+        begin = time.time()
+        for _ in range(max(num // batch, 1)):
+            sess.run(samples, feed_dict={noise: batch_noise})
+        seconds = time.time() - begin
+    return {'sample_images_per_sec': max(num // batch, 1) * batch / seconds}
+
+
+def bench_repair(num, epochs):
+    """
+    the throughput of 'repair.Repairer', with a fixed number of epochs (no early stopping)
+    """
+    repair.epochs = epochs
+    repair.patience = 0
+    repair.prune_ratio = 0
+    imgs = np.random.uniform(-1, 1, size=(num, GAN.image_height, GAN.image_width, GAN.image_depth))
+    masks = np.stack([image_util.get_mask(repair.mask)] * num)
+    repairer = repair.Repairer(num, 0)
+    try:
+        # warm up
+        repairer.repair(imgs, masks)
+        begin = time.time()
+        repairer.repair(imgs, masks)
+        seconds = time.time() - begin
+    finally:
+        repairer.close()
+    return {'repair_iterations_per_sec': epochs / seconds, 'repair_images_per_sec': num / seconds}
+
+
+def compare(results, baseline, tolerance):
+    """
+    compare the results with baseline
+    :param results: a dict of throughputs
+    :param baseline: a dict of throughputs saved before
+    :param tolerance: a result lower than (1 - tolerance) * baseline is a regression
+    :return:
+     regressions: the names of results regressed
+    """
+    regressions = []
+    print("{:<28}{:>14}{:>14}{:>9}".format('benchmark', 'result', 'baseline', 'ratio'))
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        ratio = value / base if base else float('nan')
+        flag = ''
+        if base and ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("{:<28}{:>14.2f}{:>14.2f}{:>9.2f} {}{}".format(name, value, base or float('nan'), ratio,
+                                                              UNITS.get(name, ''), flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='measure the throughput of training, sampling, repairing and '
+                                                 'reading data')
+    parser.add_argument('--out', default='benchmark.json', help='the path for saving results')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='the results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='the tolerated ratio of slowing down')
+    parser.add_argument('--images', type=int, default=300, help='the number of synthetic images')
+    parser.add_argument('--train-epochs', type=int, default=2, help='the number of epochs trained')
+    parser.add_argument('--samples', type=int, default=2048, help='the number of images sampled')
+    parser.add_argument('--sample-batch', type=int, default=256, help='the number of images sampled in each run')
+    parser.add_argument('--repair-images', type=int, default=8, help='the number of images repaired together')
+    parser.add_argument('--repair-epochs', type=int, default=50, help='the number of epochs of repairing')
+    args = parser.parse_args()
+
+    config.use(config.load())
+    np.random.seed(0)
+    tf.set_random_seed(0)
+    root = tempfile.mkdtemp(prefix='dcgan_benchmark_')
+    try:
+        image_util.cache_path = os.path.join(root, 'cache/')
+        image_util.dataset_path = ''
+        image_util.result_path = os.path.join(root, 'result/')
+        image_util.repair_path = os.path.join(root, 'repair/')
+        image_util.model_path = os.path.join(root, 'model/')
+        GAN.log_path = os.path.join(root, 'log/')
+        for path in [image_util.result_path, image_util.repair_path, image_util.model_path]:
+            os.makedirs(path)
+
+        results = {}
+        results.update(bench_ingest(root, args.images))
+        results.update(bench_train(root, args.images, args.train_epochs))
+        make_model(0)
+        results.update(bench_sample(root, args.samples, args.sample_batch))
+        results.update(bench_repair(args.repair_images, args.repair_epochs))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {'results': results,
+              'environment': {'python': platform.python_version(), 'tensorflow': tf.__version__,
+                              'machine': platform.machine(), 'cpu_count': os.cpu_count()},
+              'args': vars(args)}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print("baseline is saved to {}".format(args.baseline))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    return 1 if compare(results, baseline, args.tolerance) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import re
+import pickle
+import hashlib
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+class BackgroundSaver(object):
+    """
+    save models without blocking the training. The values of variables are copied from the session quickly, then they
+    are written by a thread through a shadow graph, whose variables have the same names in checkpoint as the original
+    ones, so the model could be restored by a normal 'tf.train.Saver'. Only one model could be written at a time,
+    'save' waits for the previous one.
+    """
+
+    def __init__(self, var_list, max_to_keep):
+        """
+        :param var_list: the variables to save, including the states of optimizers
+        :param max_to_keep: the number of models to keep
+        """
+        self.var_list = var_list
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.holders = []
+            shadows = {}
+            loads = []
+            for i, var in enumerate(var_list):
+                dtype = var.dtype.base_dtype
+                shadow = tf.Variable(tf.zeros(var.shape, dtype=dtype), name='shadow_{}'.format(i), trainable=False)
+                holder = tf.placeholder(dtype, var.shape)
+                loads.append(tf.assign(shadow, holder))
+                self.holders.append(holder)
+                shadows[var.op.name] = shadow
+            self.load = tf.group(*loads)
+            self.saver = tf.train.Saver(shadows, max_to_keep=max_to_keep)
+            init = tf.global_variables_initializer()
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph)
+        self.sess.run(init)
+        self.thread = None
+        self.error = None
+        self.states = []
+
+    def save(self, sess, save_path, global_step, state=None):
+        """
+        copy the variables and save them in background
+        :param sess: the session of training
+        :param save_path: the prefix of model files, e.g. model_path + 'model'
+        :param global_step: the suffix of model files, the files are named as 'model-(global_step)'
+        :param state: a picklable object saved beside the model as 'model-(global_step).state', e.g. random state
+        :return:
+        """
+        self.wait()
+        # the fetched arrays may share memory with the variables, so copy them before training goes on
+        values = [np.array(value, copy=True) for value in sess.run(self.var_list)]
+        self.thread = threading.Thread(target=self._write, args=(values, save_path, global_step, state))
+        self.thread.start()
+
+    def _write(self, values, save_path, global_step, state):
+        try:
+            self.sess.run(self.load, feed_dict=dict(zip(self.holders, values)))
+            path = '{}-{}'.format(save_path, global_step)
+            if state is not None:
+                # the state is written first, the model becomes the latest after it's complete
+                with open(path + '.state', 'wb') as f:
+                    pickle.dump(state, f)
+                self.states.append(path)
+            self.saver.save(self.sess, save_path, global_step=global_step, write_meta_graph=False)
+            # remove the states of models deleted by saver
+            for path in [each for each in self.states if each not in self.saver.last_checkpoints]:
+                self.states.remove(path)
+                if os.path.exists(path + '.state'):
+                    os.remove(path + '.state')
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """
+        wait for the model being written, and raise its error if any
+        :return:
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.wait()
+        self.sess.close()
+
+
+def model_fingerprint(model_file):
+    """
+    a short fingerprint of a saved model, to tell if something built from a model (e.g. the index of noises) belongs
+    to it. The '.index' file of a checkpoint holds the checksums of all tensors, so its digest changes with the weights
+    :param model_file: the prefix of model files, e.g. './model/model-800'
+    :return:
+     fingerprint: 'model-800 (digest)'
+    """
+    with open(model_file + '.index', 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    return '{} {}'.format(os.path.basename(model_file), digest)
+
+
+def restore_latest(sess, saver, model_dir):
+    """
+    restore the latest model in given directory
+    :param sess: the session to restore
+    :param saver: the 'tf.train.Saver' of variables
+    :param model_dir: the directory of models
+    :return:
+     global_step: the global step of restored model, None if there is no model
+     state: the state saved with model by 'BackgroundSaver.save', None if there is no state
+    """
+    path = tf.train.latest_checkpoint(model_dir)
+    if path is None:
+        return None, None
+    saver.restore(sess, path)
+    global_step = int(re.search(r'-(\d+)$', path).group(1))
+    state = None
+    if os.path.exists(path + '.state'):
+        with open(path + '.state', 'rb') as f:
+            state = pickle.load(f)
+    return global_step, state
@@ -0,0 +1,220 @@
+"""
+The entry points of training, repairing, sampling and building data, e.g.
+    python cli.py train
+    python cli.py --config other.cfg --set repair.batch_size=32 repair ./data_1/target.jpg
+    python cli.py ingest video.mp4 --every 6
+TensorFlow is imported only by the commands using it, so 'ingest', 'dataset' and 'config' start quickly.
+"""
+import sys
+import argparse
+import config
+
+
+def parse_settings(settings):
+    """
+    parse the settings given as 'section.key=value'
+    :param settings: a list of strings
+    :return:
+     a list of (section, key, value)
+    """
+    parsed = []
+    for setting in settings:
+        name, sep, value = setting.partition('=')
+        section, dot, key = name.partition('.')
+        if not sep or not dot:
+            raise ValueError("setting {} is not as 'section.key=value'".format(setting))
+        parsed.append((section.strip(), key.strip(), value.strip()))
+    return parsed
+
+
+def get_config(path=None, settings=()):
+    """
+    load a config and override some settings of it
+    :param path: the path of config file, see 'config.load'
+    :param settings: a list of 'section.key=value'
+    :return:
+     cfg: the 'config.Config'
+    """
+    cfg = config.load(path)
+    for section, key, value in parse_settings(settings):
+        if not cfg.has_option(section, key):
+            raise ValueError("unknown setting {}.{}".format(section, key))
+        cfg.set(section, key, value)
+    return cfg
+
+
+def run_train(args):
+    import tensorflow as tf
+    import cly_dcgan as GAN
+    with tf.Graph().as_default():
+        GAN.train()
+
+
+def run_repair(args):
+    import repair
+    repair.repair(args.paths or None)
+
+
+def run_export(args):
+    import sample
+    sample.export(args.model_index, args.out, args.fold)
+
+
+def run_sample(args):
+    import sample
+    sample.sample(args.num, args.out, args.batch_size, args.shard_size, args.seed, args.jpg)
+
+
+def run_ingest(args):
+    import ingest
+    ingest.ingest(args.videos, args.out, args.every, args.crop, args.workers, args.max_pending, args.seek)
+
+
+def run_serve(args):
+    import server
+    server.serve()
+
+
+def run_sweep(args):
+    import sweep
+    runs = sweep.get_runs(args.grid, args.runs)
+    if not runs:
+        raise ValueError('no run is given by --grid or --runs')
+    sweep.sweep(runs, args.out, args.workers)
+
+
+def run_index(args):
+    import latent_index
+    cfg = config.current
+    latent_index.build(args.out or cfg.get('repair', 'index_path'), args.num, args.batch_size,
+                       cfg.getint('repair', 'index_thumb'), args.seed, cfg.getint('repair', 'index_max'))
+
+
+def run_best(args):
+    import image_util
+    import evaluate
+    index, scores = evaluate.best_model(config.current.get('file', 'log_path'), image_util.model_path, args.metric)
+    if index is None:
+        print("no saved model is scored")
+        return
+    print("model-{} {}".format(index, ', '.join('{}: {:.4g}'.format(key, scores[key])
+                                                 for key in ('frechet', 'hist_tv') if key in scores)))
+
+
+def run_dataset(args):
+    import image_util
+    dataset = image_util.get_dataset(config.current.getint('image', 'image_num'))
+    print("{} images in {} shards in {}".format(len(dataset), len(dataset.shards),
+                                                image_util.dataset_path or image_util.cache_path))
+
+
+def run_config(args):
+    config.current.write(sys.stdout)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='train DCGAN, repair images with it, and build the data')
+    parser.add_argument('--config', default=None, help="the config file, 'net.cfg' by default")
+    parser.add_argument('--set', dest='settings', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a setting of config, could be given several times')
+    subparsers = parser.add_subparsers(dest='command')
+
+    train_parser = subparsers.add_parser('train', help='train DCGAN')
+    train_parser.set_defaults(run=run_train)
+
+    repair_parser = subparsers.add_parser('repair', help='repair images')
+    repair_parser.add_argument('paths', nargs='*', help="the images to repair, the ones given by 'target_path' by "
+                                                        "default")
+    repair_parser.set_defaults(run=run_repair)
+
+    export_parser = subparsers.add_parser('export', help='freeze G of a model for inference')
+    export_parser.add_argument('--model-index', type=int, required=True, help='the index of model to export')
+    export_parser.add_argument('--out', default=None, help='the path of frozen graph')
+    export_parser.add_argument('--fold', dest='fold', action='store_true', default=None, help='fold BN')
+    export_parser.add_argument('--no-fold', dest='fold', action='store_false', help="don't fold BN")
+    export_parser.set_defaults(run=run_export)
+
+    sample_parser = subparsers.add_parser('sample', help='generate images with the frozen G')
+    sample_parser.add_argument('--num', type=int, required=True, help='the number of images to generate')
+    sample_parser.add_argument('--out', default=None, help='the directory to save the shards')
+    sample_parser.add_argument('--batch-size', type=int, default=None, help='the number of images in each run')
+    sample_parser.add_argument('--shard-size', type=int, default=None, help='the number of images in each shard')
+    sample_parser.add_argument('--seed', type=int, default=None, help='the seed of noise')
+    sample_parser.add_argument('--jpg', action='store_true', help='save the images as jpg')
+    sample_parser.set_defaults(run=run_sample)
+
+    ingest_parser = subparsers.add_parser('ingest', help='build the train data from videos')
+    ingest_parser.add_argument('videos', nargs='+', help='the paths of videos')
+    ingest_parser.add_argument('--out', default=None, help='the directory of packed dataset, dataset_path by default')
+    ingest_parser.add_argument('--every', type=int, default=6, help='keep one frame in every EVERY frames')
+    ingest_parser.add_argument('--crop', type=int, nargs=4, default=None, metavar=('TOP', 'BOTTOM', 'LEFT', 'RIGHT'),
+                               help='the area kept in each frame, e.g. 70 690 0 540')
+    ingest_parser.add_argument('--workers', type=int, default=None, help='the number of threads')
+    ingest_parser.add_argument('--max-pending', type=int, default=None,
+                               help='the most number of frames held in memory')
+    ingest_parser.add_argument('--seek', action='store_true', help='seek to the frames wanted instead of grabbing all')
+    ingest_parser.set_defaults(run=run_ingest)
+
+    serve_parser = subparsers.add_parser('serve', help='repair the images posted by http, see [server] in config')
+    serve_parser.set_defaults(run=run_serve)
+
+    sweep_parser = subparsers.add_parser('sweep', help='train with several configurations at the same time')
+    sweep_parser.add_argument('--grid', action='append', default=[], metavar='SECTION.KEY=VALUE1,VALUE2',
+                              help='the values of a setting, every combination of the values is a run')
+    sweep_parser.add_argument('--runs', default=None, help='a json file with a list of runs, each one is a dict of '
+                                                           '{"section.key": value}')
+    sweep_parser.add_argument('--out', default='./sweep/', help='the directory of runs')
+    sweep_parser.add_argument('--workers', type=int, default=2, help='the number of runs trained at the same time')
+    sweep_parser.set_defaults(run=run_sweep)
+
+    index_parser = subparsers.add_parser('index', help='add noises to the index for repairing by sampling the '
+                                                       'frozen G')
+    index_parser.add_argument('--num', type=int, required=True, help='the number of noises to add')
+    index_parser.add_argument('--out', default=None, help="the path of index, 'index_path' by default")
+    index_parser.add_argument('--batch-size', type=int, default=1024, help='the number of images generated in each run')
+    index_parser.add_argument('--seed', type=int, default=0, help='the seed of noise')
+    index_parser.set_defaults(run=run_index)
+
+    best_parser = subparsers.add_parser('best', help='print the saved model with the best score in training')
+    best_parser.add_argument('--metric', default=None, help="'frechet' or 'hist_tv', 'eval_metric' by default")
+    best_parser.set_defaults(run=run_best)
+
+    dataset_parser = subparsers.add_parser('dataset', help="pack the images in 'read_path' to 'cache_path', or check "
+                                                           "'dataset_path'")
+    dataset_parser.set_defaults(run=run_dataset)
+
+    config_parser = subparsers.add_parser('config', help='print the config in use')
+    config_parser.set_defaults(run=run_config)
+
+    # the same options after the command, e.g. 'python repair.py --config other.cfg' runs 'cli.py repair --config
+    # other.cfg'. they are kept apart from the ones before the command, which would be replaced otherwise
+    for command_parser in subparsers.choices.values():
+        command_parser.add_argument('--config', dest='command_config', default=None, metavar='CONFIG',
+                                    help="the config file, 'net.cfg' by default")
+        command_parser.add_argument('--set', dest='command_settings', action='append', default=[],
+                                    metavar='SECTION.KEY=VALUE',
+                                    help='override a setting of config, could be given several times')
+    return parser
+
+
+def main(argv=None):
+    """
+    run a command
+    :param argv: the arguments, 'sys.argv[1:]' by default
+    :return:
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    try:
+        cfg = get_config(args.command_config or args.config, args.settings + args.command_settings)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    config.use(cfg)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,51 @@
 import os
 import numpy as np
-import configparser as cfg_parser
+import config
 import tensorflow as tf
 import image_util
+import telemetry
+import checkpoint
+import evaluate
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
 
-cp = cfg_parser.ConfigParser()
-cp.read('net.cfg')
-batch_size = cp.getint('train', 'batch_size')
-noise_size = cp.getint('train', 'noise_size')
-epochs = cp.getint('train', 'epochs')
-n_samples = cp.getint('train', 'n_samples')
-learning_rate = cp.getfloat('train', 'learning_rate')
-beta1 = cp.getfloat('train', 'beta1')
-max_to_keep = cp.getint('train', 'max_to_keep')
-break_time = cp.getint('train', 'break_time')
-image_num = cp.getint('image', 'image_num')
-image_height = cp.getint('image', 'image_height')
-image_width = cp.getint('image', 'image_width')
-image_depth = cp.getint('image', 'image_depth')
+
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global batch_size, noise_size, epochs, n_samples, learning_rate, beta1, max_to_keep, break_time, prefetch_depth, \
+        shuffle, d_steps, alternate, debug_graph, contact_sheet, print_every, resume, seed, intra_op_threads, \
+        inter_op_threads, towers, log_path, image_num, image_height, image_width, image_depth
+    batch_size = cfg.getint('train', 'batch_size')
+    noise_size = cfg.getint('train', 'noise_size')
+    epochs = cfg.getint('train', 'epochs')
+    n_samples = cfg.getint('train', 'n_samples')
+    learning_rate = cfg.getfloat('train', 'learning_rate')
+    beta1 = cfg.getfloat('train', 'beta1')
+    max_to_keep = cfg.getint('train', 'max_to_keep')
+    break_time = cfg.getint('train', 'break_time')
+    prefetch_depth = cfg.getint('train', 'prefetch_depth')
+    shuffle = cfg.getboolean('train', 'shuffle')
+    d_steps = cfg.getint('train', 'd_steps')
+    alternate = cfg.getboolean('train', 'alternate')
+    debug_graph = cfg.getboolean('train', 'debug_graph')
+    contact_sheet = cfg.getboolean('train', 'contact_sheet')
+    print_every = cfg.getfloat('train', 'print_every')
+    resume = cfg.getboolean('train', 'resume')
+    seed = cfg.get('train', 'seed')
+    seed = int(seed) if seed else None
+    intra_op_threads = cfg.getint('train', 'intra_op_threads')
+    inter_op_threads = cfg.getint('train', 'inter_op_threads')
+    towers = cfg.getint('train', 'towers')
+    log_path = cfg.get('file', 'log_path')
+    image_num = cfg.getint('image', 'image_num')
+    image_height = cfg.getint('image', 'image_height')
+    image_width = cfg.getint('image', 'image_width')
+    image_depth = cfg.getint('image', 'image_depth')
 
 
 def get_inputs():
@@ -85,6 +111,70 @@ def get_generator(noise, training, reuse, alpha=0.1):
         return outputs
 
 
+def fold_generator(model_file, epsilon=1e-3):
+    """
+    read the variables of G from model file, and fold the frozen BN (moving mean and variance) of each layer into 
+    the weights of layer before it:
+        BN(x * W + b) = x * (W * s) + ((b - mean) * s + beta),  s = gamma / sqrt(variance + epsilon)
+    :param model_file: the path of model, e.g. model_path + 'model-800'
+    :param epsilon: the epsilon of BN, it's 1e-3 by default in 'tf.layers.batch_normalization'
+    :return: 
+     weights: a list of (kernel, bias) of each layer (dense and reverse conv), used by 'get_folded_generator'
+    """
+    reader = tf.train.NewCheckpointReader(model_file)
+
+    def get(name):
+        return reader.get_tensor('generator/' + name).astype(np.float64)
+
+    layers = ['dense', 'conv2d_transpose', 'conv2d_transpose_1', 'conv2d_transpose_2', 'conv2d_transpose_3']
+    bns = ['batch_normalization', 'batch_normalization_1', 'batch_normalization_2', 'batch_normalization_3', None]
+    weights = []
+    for layer, bn in zip(layers, bns):
+        kernel, bias = get(layer + '/kernel'), get(layer + '/bias')
+        if bn is not None:
+            scale = get(bn + '/gamma') / np.sqrt(get(bn + '/moving_variance') + epsilon)
+            mean, shift = get(bn + '/moving_mean'), get(bn + '/beta')
+            if layer == 'dense':
+                # the outputs of dense are reshaped to [4, 4, 1024], the channel of j-th output is j % 1024
+                repeat = kernel.shape[1] // len(scale)
+                scale, mean, shift = np.tile(scale, repeat), np.tile(mean, repeat), np.tile(shift, repeat)
+                kernel = kernel * scale
+            else:
+                # the kernel of reverse conv is [height, width, out_channels, in_channels]
+                kernel = kernel * scale[np.newaxis, np.newaxis, :, np.newaxis]
+            bias = (bias - mean) * scale + shift
+        weights.append((kernel.astype(np.float32), bias.astype(np.float32)))
+    return weights
+
+
+def get_folded_generator(noise, weights, alpha=0.1):
+    """
+    the structure of G only for inference, with BN folded by 'fold_generator'. each layer is only a dense or reverse
+    conv with bias, followed by leaky RELU, so it's much cheaper than 'get_generator(noise, False, True)' with the
+    same outputs. the weights are constants, so it needs no variable or model file.
+    :param noise: the input of G, the shape should be [?, noise_size]
+    :param weights: the folded weights calculated by 'fold_generator'
+    :param alpha: a param of activation function(leaky RELU)
+    :return: 
+     outputs: the output of G with such input, with shape[?, image_height, image_width, image_depth]
+    """
+    with tf.name_scope("folded_generator"):
+        kernel, bias = weights[0]
+        layer = tf.nn.bias_add(tf.matmul(noise, tf.constant(kernel)), tf.constant(bias))
+        layer = tf.reshape(layer, [-1, 4, 4, 1024])
+        layer = tf.nn.leaky_relu(layer, alpha)
+        for i, (kernel, bias) in enumerate(weights[1:]):
+            height, width = int(layer.shape[1]), int(layer.shape[2])
+            output_shape = tf.stack([tf.shape(layer)[0], height * 2, width * 2, kernel.shape[2]])
+            layer = tf.nn.conv2d_transpose(layer, tf.constant(kernel), output_shape, [1, 2, 2, 1], padding='SAME')
+            layer = tf.nn.bias_add(layer, tf.constant(bias))
+            if i < len(weights) - 2:
+                layer = tf.nn.leaky_relu(layer, alpha)
+        # the static shape is lost in conv2d_transpose with dynamic batch size
+        layer = tf.reshape(layer, [-1, image_height, image_width, image_depth])
+        return tf.tanh(layer)
+
+
 def get_discriminator(input_imgs, training, reuse, alpha=0.1):
     """
     define the structure of G
@@ -141,7 +231,7 @@ def get_discriminator(input_imgs, training, reuse, alpha=0.1):
         return logits, outputs
 
 
-def get_loss(noise, real_imgs, smooth=0.05):
+def get_loss(noise, real_imgs, smooth=0.05, reuse=False):
     """
     calculate the loss with given data. the loss can be divided for two parts -- the loss of D and the loss of G. 
     D_loss symbols the level of distinction of given image, while the G_loss symbols the ability of fake image.
@@ -154,13 +244,14 @@ def get_loss(noise, real_imgs, smooth=0.05):
     :param real_imgs: the real images from train_data, whose range has been reflected from [0, 255] to [-1, 1]
                         in each channel 
     :param smooth: a param for prevent from overfitting, set the label value with (1-smooth) but not 1.
+    :param reuse: boolean, reuse the variables of G and D or not (for the towers except the first one)
     :return: 
      return a tuple contain two part: (G_loss, D_loss)
     """
 
     # ========================begin: calculate g_loss ========================
-    g_outputs = get_generator(noise, True, False)
-    d_logits_fake, d_outputs_fake = get_discriminator(g_outputs, True, False)
+    g_outputs = get_generator(noise, True, reuse)
+    d_logits_fake, d_outputs_fake = get_discriminator(g_outputs, True, reuse)
     """ !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!  
     G_loss: minimize[log(1-D(G(z)))] to minimize[- log(D(G(z)))] 
     The G_loss in paper is defined as log(1-D(G(z))), however it not suitable with sigmoid activation function.
@@ -212,100 +303,263 @@ def get_loss(noise, real_imgs, smooth=0.05):
     return g_loss, d_loss
 
 
-def get_optimizer(g_loss, d_loss):
+def get_tower_loss(noise, real_imgs, num_towers):
+    """
+    split the batch to 'num_towers' parts, and calculate the loss of each part on its own CPU device. all towers share
+    the same variables of G and D.
+    :param noise: the input of G, the noise prepared for G.
+    :param real_imgs: the real images from train_data, whose range has been reflected to [-1, 1]
+    :param num_towers: the number of towers, the batch size should be divisible by it
+    :return: 
+     g_losses: a list contains G_loss of each tower
+     d_losses: a list contains D_loss of each tower
+    """
+    if num_towers == 1:
+        g_loss, d_loss = get_loss(noise, real_imgs)
+        return [g_loss], [d_loss]
+
+    g_losses, d_losses = [], []
+    for i, (tower_noise, tower_imgs) in enumerate(zip(tf.split(noise, num_towers), tf.split(real_imgs, num_towers))):
+        with tf.device('/cpu:{}'.format(i)), tf.name_scope('tower_{}'.format(i)):
+            g_loss, d_loss = get_loss(tower_noise, tower_imgs, reuse=i > 0)
+        g_losses.append(g_loss)
+        d_losses.append(d_loss)
+    return g_losses, d_losses
+
+
+def average_gradients(tower_grads):
+    """
+    average the gradients of each variable over towers
+    :param tower_grads: a list contains the list of (gradient, variable) of each tower
+    :return: 
+     grads: a list of (averaged gradient, variable)
+    """
+    if len(tower_grads) == 1:
+        return tower_grads[0]
+    grads = []
+    for grads_and_vars in zip(*tower_grads):
+        grad = tf.add_n([each_grad for each_grad, _ in grads_and_vars]) / len(grads_and_vars)
+        grads.append((grad, grads_and_vars[0][1]))
+    return grads
+
+
+def get_optimizer(g_loss, d_loss, alternate_steps=None):
     """
     Define the optimizer for minimizing the loss. Here we pick the AdamOptimizer. Surely you can replace with other OPT.
+    By default the updates of G and D are simultaneous: a fused optimizer calculates the gradients of both from the same
+    forward pass before any variable is updated, so a single 'sess.run' updates both nets and the output of G is only
+    calculated once. Then the gradient of G comes from D before its update. If 'alternate_steps' is set, G has its own
+    optimizer instead, which is run after D is updated, as in the paper.
     
-    :param g_loss: loss of G net. calculated by 'get_loss'
-    :param d_loss: loss of D net. calculated by 'get_loss'
+    :param g_loss: loss of G net. calculated by 'get_loss', or a list of them calculated by 'get_tower_loss'
+    :param d_loss: loss of D net. calculated by 'get_loss', or a list of them calculated by 'get_tower_loss'
+    :param alternate_steps: boolean, update D and G alternately, it's 'alternate' by default
     :return: 
-     g_opt: Optimizer for g_loss
+     g_opt: Optimizer for g_loss, None unless 'alternate_steps' is set
      d_opt: Optimizer for d_loss
+     gd_opt: Optimizer for both g_loss and d_loss in one step, None if 'alternate_steps' is set
     """
+    alternate_steps = alternate if alternate_steps is None else alternate_steps
+    g_losses = g_loss if isinstance(g_loss, list) else [g_loss]
+    d_losses = d_loss if isinstance(d_loss, list) else [d_loss]
 
     # 'tf.trainable_variables()' would return variables trainable in graph. We divide variables to G_vars and D_vars.
     train_vars = tf.trainable_variables()
     g_vars = [var for var in train_vars if var.name.startswith("generator")]
     d_vars = [var for var in train_vars if var.name.startswith("discriminator")]
 
-    with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
-        g_opt = tf.train.AdamOptimizer(learning_rate=learning_rate, beta1=beta1).minimize(g_loss, var_list=g_vars)
-        d_opt = tf.train.AdamOptimizer(learning_rate=learning_rate, beta1=beta1).minimize(d_loss, var_list=d_vars)
+    g_adam = tf.train.AdamOptimizer(learning_rate=learning_rate, beta1=beta1)
+    d_adam = tf.train.AdamOptimizer(learning_rate=learning_rate, beta1=beta1)
+    # the moving mean and variance of BN are only updated by the first tower
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, scope='tower_0' if len(g_losses) > 1 else None)
+    with tf.control_dependencies(update_ops):
+        # the gradients of each tower are calculated on its own device
+        g_grads = average_gradients([g_adam.compute_gradients(loss, var_list=g_vars, colocate_gradients_with_ops=True)
+                                     for loss in g_losses])
+        d_grads = average_gradients([d_adam.compute_gradients(loss, var_list=d_vars, colocate_gradients_with_ops=True)
+                                     for loss in d_losses])
+        d_opt = d_adam.apply_gradients(d_grads)
+        if alternate_steps:
+            return g_adam.apply_gradients(g_grads), d_opt, None
+
+    # no variable could be changed before all gradients are calculated
+    with tf.control_dependencies([grad for grad, _ in g_grads + d_grads]):
+        gd_opt = tf.group(g_adam.apply_gradients(g_grads), d_adam.apply_gradients(d_grads))
 
-    return g_opt, d_opt
+    return None, d_opt, gd_opt
+
+
+def get_session_config():
+    """
+    the config of session: the number of threads used in one op (intra) and for running ops in parallel (inter), 0 
+    means the number of cores. each tower has its own CPU device
+    :return: 
+     config: tf.ConfigProto
+    """
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads,
+                          device_count={'CPU': towers})
 
 
-def show_generator_output(sess, noise_holder):
+def show_generator_output(sess, noise_holder, sampler):
     """
     get the outputs of G, the input of G will be create with 'random' in function inside.
     :param sess:  session 
     :param noise_holder: the placeholder of input of G
+    :param sampler: the output of G in inference mode, built once by 'get_generator(noise_holder, False, True)'
     :return: 
      samples: imgs generated by G, but the range of value is still [-1, 1]
     """
     batch_noise = np.random.uniform(-1, 1, size=(n_samples, noise_size))
-    samples = sess.run(get_generator(noise_holder, False, True), feed_dict={noise_holder: batch_noise})
+    samples = sess.run(sampler, feed_dict={noise_holder: batch_noise})
     return samples
 
 
-def train():
+def check_graph(graph, op_count, where):
+    """
+    report the number of ops in graph and fail fast if the graph grows, any op created in the loop would make the 
+    graph, memory and time of each step grow steadily.
+    :param graph: the graph should keep constant
+    :param op_count: the number of ops when the graph was finished
+    :param where: a message shows where the check happened
+    :return: 
+    """
+    count = len(graph.get_operations())
+    print("{}: {} ops in graph".format(where, count))
+    if count != op_count:
+        raise RuntimeError("graph grows from {} to {} ops in {}".format(op_count, count, where))
+
+
+def train(dataset=None, reference=None):
     """
     the training part of project, we will do such: define graph, send data, optimize, save model... 
+    :param dataset: the train data as 'image_util.Dataset', it's packed from 'read_path' by default
+    :param reference: the 'evaluate.ImageStats' of dataset, it's computed (or loaded from 'log_path') if scoring is on
     :return: 
     
     """
 
     # define graph of DCGAN
+    if batch_size % towers != 0:
+        raise ValueError("batch_size {} is not divisible by towers {}".format(batch_size, towers))
     inputs_real, inputs_noise = get_inputs()
-    g_loss, d_loss = get_loss(inputs_noise, inputs_real)
-    g_train_opt, d_train_opt = get_optimizer(g_loss, d_loss)
+    g_losses, d_losses = get_tower_loss(inputs_noise, inputs_real, towers)
+    g_loss = tf.add_n(g_losses) / towers
+    d_loss = tf.add_n(d_losses) / towers
+    g_train_opt, d_train_opt, gd_train_opt = get_optimizer(g_losses, d_losses)
+    sampler = get_generator(inputs_noise, False, True)
+    saver = tf.train.Saver(max_to_keep=max_to_keep)
+    # the models are written in background, with the states of optimizers
+    background_saver = checkpoint.BackgroundSaver(tf.global_variables(), max_to_keep)
+    init = tf.global_variables_initializer()
+    # nothing could be added to the graph in the loop
+    tf.get_default_graph().finalize()
+    op_count = len(tf.get_default_graph().get_operations())
 
     # feed with data -- start to train
-    with tf.Session() as sess:
+    with tf.Session(config=get_session_config()) as sess:
         begin_time = 0
-        saver = tf.train.Saver(max_to_keep=max_to_keep)
-        sess.run(tf.global_variables_initializer())
-        #
+        step = 0
+        train_seed = seed if seed is not None else np.random.randint(2 ** 31)
+        sess.run(init)
         # =============== recover the net param from saved model for further training =================
-        # begin_time = 10
-        # recover = tf.train.import_meta_graph(image_util.model_path+'model-{}.meta'.format(begin_time))
-        # recover.restore(sess, tf.train.latest_checkpoint(image_util.model_path))
+        if resume:
+            last_epoch, state = checkpoint.restore_latest(sess, saver, image_util.model_path)
+            if last_epoch is not None:
+                print("resume from model-{}".format(last_epoch))
+                begin_time = last_epoch + 1
+            if state is not None:
+                step = state['step']
+                train_seed = state['seed']
+                np.random.set_state(state['numpy_random'])
         # =============================================================================================
 
-        for epoch in range(begin_time, epochs):
-            images = image_util.get_imgs(image_num)
-
-            for batch_i in range(images.shape[0]  // batch_size):
-                print("training in (epoch = {}, batch = {})".format(epoch, batch_i))
-                batch_images = images[batch_i * batch_size: (batch_i + 1) * batch_size]
-
-                # ============= we choose the image data sequential, you can also select with random ==============
-                # batch_images = images.tolist()
-                # batch_images = random.sample(batch_images, batch_size)
-                # batch_images = np.array(batch_images)
-                # batch_images.reshape(-1,64,64,3)
-                # ==================================================================================================
-
-                # reflect the range of input of G from [0 1] to [-1, 1]
-                batch_images = batch_images * 2 - 1
-                batch_noise = np.random.uniform(-1, 1, size=(batch_size, noise_size))
-
-                # doing k iteration for G after doing one iteration for D was recommended in paper. Here k=1
-                sess.run(d_train_opt, feed_dict={inputs_real: batch_images, inputs_noise: batch_noise})
-                sess.run(g_train_opt, feed_dict={inputs_real: batch_images, inputs_noise: batch_noise})
-
-            train_loss_g = g_loss.eval({inputs_real: batch_images, inputs_noise: batch_noise})
-            train_loss_d = d_loss.eval({inputs_real: batch_images, inputs_noise: batch_noise})
-            print("g_loss:", train_loss_g)
-            print("d_loss:", train_loss_d)
-            # save images generated by G after each epoch
-            samples = show_generator_output(sess, inputs_noise)
-            image_util.plot_images(epoch, samples)
+        # the images are decoded only once, then memory-mapped from the packed dataset
+        if dataset is None:
+            dataset = image_util.get_dataset(image_num)
+        n_batches = len(dataset) // batch_size
+        # the range of images has been reflected to [-1, 1], the next batches are prepared in background
+        batches = image_util.BatchPrefetcher(dataset, batch_size, noise_size, begin_time, epochs,
+                                             prefetch_depth, shuffle, train_seed)
+        # the statistics of train data for scoring G
+        if evaluate.eval_every <= 0:
+            reference = None
+        elif reference is None:
+            reference = evaluate.get_reference(dataset, os.path.join(log_path, 'train_stats.npz'))
+        # the images generated by G are written in background, 'result_path' isn't in the repository
+        os.makedirs(image_util.result_path, exist_ok=True)
+        writer = image_util.ImageWriter()
+        # the time of each phase, losses and throughput are saved for TensorBoard
+        metrics = telemetry.Telemetry(log_path, print_every)
+        train_loss_g, train_loss_d = None, None
+        try:
+            while True:
+                with metrics.phase('data'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                epoch, batch_i, batch_images, batch_noise = batch
+                feed_dict = {inputs_real: batch_images, inputs_noise: batch_noise}
+
+                # doing k iteration for D before doing one iteration for G was recommended in paper. Here k=d_steps.
+                # each batch is fed only once, the k-th batch updates both D and G and fetches the losses in one run
+                # (or in two runs, D then G, if 'alternate' is set)
+                step += 1
+                if step % d_steps != 0:
+                    with metrics.phase('d_step'):
+                        sess.run(d_train_opt, feed_dict=feed_dict)
+                    metrics.end_step(step, epoch, batch_i, batch_size)
+                elif alternate:
+                    with metrics.phase('d_step'):
+                        sess.run(d_train_opt, feed_dict=feed_dict)
+                    with metrics.phase('g_step'):
+                        _, train_loss_g, train_loss_d = sess.run([g_train_opt, g_loss, d_loss], feed_dict=feed_dict)
+                    metrics.end_step(step, epoch, batch_i, batch_size, g_loss=train_loss_g, d_loss=train_loss_d)
+                else:
+                    with metrics.phase('gd_step'):
+                        _, train_loss_g, train_loss_d = sess.run([gd_train_opt, g_loss, d_loss], feed_dict=feed_dict)
+                    metrics.end_step(step, epoch, batch_i, batch_size, g_loss=train_loss_g, d_loss=train_loss_d)
+
+                if batch_i < n_batches - 1:
+                    continue
+                # save images generated by G after each epoch
+                if n_samples > 0:
+                    with metrics.phase('sample'):
+                        samples = show_generator_output(sess, inputs_noise, sampler)
+                    with metrics.phase('write'):
+                        image_util.plot_images(epoch, samples, writer, contact_sheet)
+                # score the images generated by G with the statistics of train data
+                if reference is not None and epoch % evaluate.eval_every == 0:
+                    with metrics.phase('eval'):
+                        scores = evaluate.evaluate(lambda noise: sess.run(sampler, feed_dict={inputs_noise: noise}),
+                                                   noise_size, reference)
+                    metrics.write('eval', epoch, scores)
+                    print("epoch {} scored, {}".format(
+                        epoch, ', '.join('{}: {:.4g}'.format(key, value) for key, value in sorted(scores.items()))))
+                if debug_graph:
+                    check_graph(sess.graph, op_count, "epoch {}".format(epoch))
+
+                # save model
+                if epoch % break_time == 0:
+                    with metrics.phase('checkpoint'):
+                        state = {'step': step, 'seed': train_seed, 'numpy_random': np.random.get_state()}
+                        background_saver.save(sess, image_util.model_path+'model', epoch, state)
+                metrics.end_epoch(epoch, g_loss=train_loss_g, d_loss=train_loss_d)
+        finally:
+            # each one is closed even if closing the others fails
+            try:
+                batches.close()
+            finally:
+                try:
+                    writer.close()
+                finally:
+                    try:
+                        metrics.close()
+                    finally:
+                        background_saver.close()
 
-            # save model
-            if epoch % break_time == 0:
-                saver.save(sess, image_util.model_path+'model', global_step=epoch)
 
 if __name__ == '__main__':
-    with tf.Graph().as_default():
-        train()
+    import sys
+    import cli
+    cli.main(['train'] + sys.argv[1:])
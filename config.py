@@ -0,0 +1,107 @@
+"""
+The configuration of training, repairing and sampling. Nothing is read when the modules are imported: their settings
+start from 'DEFAULTS' (the same as 'net.cfg' shipped with the code), and 'use' applies a 'Config' to every module,
+e.g.
+    import config, repair
+    config.use(config.load('net.cfg'))
+    repair.repair()
+"""
+import os
+import configparser as cfg_parser
+
+# the default settings, see 'net.cfg' for what they mean
+DEFAULTS = {
+    'train': {
+        'batch_size': '60', 'noise_size': '100', 'epochs': '6000', 'n_samples': '10', 'learning_rate': '0.001',
+        'beta1': '0.4', 'max_to_keep': '100', 'break_time': '5', 'resume': 'true', 'seed': '',
+        'intra_op_threads': '0', 'inter_op_threads': '0', 'towers': '1', 'prefetch_depth': '4', 'shuffle': 'true',
+        'd_steps': '1', 'alternate': 'false', 'print_every': '10', 'contact_sheet': 'false', 'debug_graph': 'false', 'eval_every': '0',
+        'eval_samples': '2000', 'eval_chunk': '500', 'eval_bins': '64', 'eval_metric': 'frechet',
+    },
+    'repair': {
+        'epochs': '100', 'learning_rate': '0.007', 'beta': '0.4', 'break_time': '100', 'threshold': '0.03',
+        'model_index': '800', 'mask': 'rect 20 15 30 18', 'batch_size': '16', 'restarts': '4', 'prune_epoch': '30',
+        'prune_ratio': '0.5', 'patience': '10', 'min_delta': '0.001', 'folded': 'true', 'tiled': 'false',
+        'tile_stride': '48', 'index_path': './model/latent.npz', 'index_thumb': '16', 'index_learn': 'false',
+        'index_max': '100000', 'debug_graph': 'false',
+    },
+    'sample': {
+        'frozen_path': './model/generator.pb', 'folded': 'true', 'sample_path': './samples/', 'batch_size': '1024',
+        'shard_size': '50000', 'seed': '0',
+    },
+    'server': {
+        'host': '127.0.0.1', 'port': '8500', 'max_batch': '16', 'max_wait': '0.05', 'latency_window': '1000',
+    },
+    'image': {
+        'image_num': '999999', 'image_height': '64', 'image_width': '64', 'image_depth': '3', 'shard_size': '20000',
+    },
+    'file': {
+        'read_path': './data_1/', 'cache_path': './cache/', 'dataset_path': '', 'writer_threads': '2',
+        'writer_queue': '64',
+        'target_path': './data_1/target.jpg', 'save_path': './data_1/', 'result_path': './result/',
+        'repair_path': './repair/', 'model_path': './model/', 'log_path': './log/',
+    },
+}
+
+# the functions registered by modules to apply a config to their settings
+_configures = []
+
+
+class Config(cfg_parser.ConfigParser):
+    """
+    the settings in sections as 'net.cfg', the ones not given in file are 'DEFAULTS'
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: the path of config file, only the defaults are used if it's None
+        """
+        super(Config, self).__init__()
+        self.read_dict(DEFAULTS)
+        if path is not None and not self.read(path):
+            raise IOError("can't read config {}".format(path))
+
+
+def load(path=None):
+    """
+    load a config file
+    :param path: the path of config file, it's 'net.cfg' in the current directory by default, and only the defaults
+                 are used if there is no such file
+    :return:
+     config: the 'Config'
+    """
+    if path is None:
+        path = 'net.cfg' if os.path.exists('net.cfg') else None
+    return Config(path)
+
+
+# the config applied to modules
+current = Config()
+
+
+def register(configure):
+    """
+    register the function reading the settings of a module, it's applied to 'current' at once. used as decorator:
+        @config.register
+        def configure(cfg):
+            global batch_size
+            batch_size = cfg.getint('train', 'batch_size')
+    :param configure: the function with a 'Config'
+    :return:
+     configure
+    """
+    _configures.append(configure)
+    configure(current)
+    return configure
+
+
+def use(cfg):
+    """
+    apply a config to all modules imported, and the ones imported later
+    :param cfg: the 'Config'
+    :return:
+    """
+    global current
+    current = cfg
+    for configure in _configures:
+        configure(cfg)
@@ -0,0 +1,193 @@
+"""
+Score the images generated by G against the train data while training, instead of looking at the images. Every
+'eval_every' epochs, 'eval_samples' images are generated in chunks and summarized by running statistics: the mean and
+covariance of the colors of pixels, and the histogram of each channel. They are compared with the same statistics of
+the train data:
+    frechet: the Frechet distance between the gaussians of pixel colors, 0 means the same mean and covariance
+    hist_tv: the total variation distance between the histograms of each channel (averaged), in [0, 1]
+The scores are saved in 'metrics.jsonl' (records of type 'eval'), 'best_model' picks the saved model with the best one.
+"""
+import os
+import json
+import numpy as np
+import config
+
+
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global eval_every, eval_samples, eval_chunk, eval_bins, eval_metric
+    eval_every = cfg.getint('train', 'eval_every')
+    eval_samples = cfg.getint('train', 'eval_samples')
+    eval_chunk = cfg.getint('train', 'eval_chunk')
+    eval_bins = cfg.getint('train', 'eval_bins')
+    eval_metric = cfg.get('train', 'eval_metric')
+
+
+class ImageStats(object):
+    """
+    the running statistics of the pixels of images, updated chunk by chunk so the images are never held together. The
+    mean and covariance are merged by the parallel algorithm of Chan et al.:
+        mean = mean_a + delta * n_b / n
+        m2 = m2_a + m2_b + delta^T delta * n_a * n_b / n,  delta = mean_b - mean_a
+    """
+
+    def __init__(self, depth, bins):
+        """
+        :param depth: the number of channels
+        :param bins: the number of bins of histograms in [-1, 1]
+        """
+        self.count = 0
+        # the fingerprint of the images, see 'get_reference'
+        self.source = ''
+        self.mean = np.zeros(depth)
+        self.m2 = np.zeros((depth, depth))
+        self.hist = np.zeros((depth, bins), dtype=np.int64)
+
+    def update(self, imgs):
+        """
+        add images to the statistics
+        :param imgs: the images with shape [?, height, width, depth], the range is [-1, 1]
+        :return:
+        """
+        pixels = np.asarray(imgs, dtype=np.float64).reshape(-1, self.mean.shape[0])
+        count = len(pixels)
+        if count == 0:
+            return
+        mean = pixels.mean(axis=0)
+        centered = pixels - mean
+        m2 = centered.T.dot(centered)
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + np.outer(delta, delta) * self.count * count / total
+        self.count = total
+
+        bins = self.hist.shape[1]
+        indices = np.clip(((pixels + 1) / 2 * bins).astype(np.int64), 0, bins - 1)
+        for channel in range(self.hist.shape[0]):
+            self.hist[channel] += np.bincount(indices[:, channel], minlength=bins)
+
+    @property
+    def cov(self):
+        return self.m2 / max(self.count - 1, 1)
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, count=self.count, mean=self.mean, m2=self.m2, hist=self.hist, source=self.source)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            stats = ImageStats(data['mean'].shape[0], data['hist'].shape[1])
+            stats.count, stats.mean, stats.m2, stats.hist = int(data['count']), data['mean'], data['m2'], data['hist']
+            stats.source = str(data['source']) if 'source' in data.files else ''
+        return stats
+
+
+def sqrtm_psd(matrix):
+    """
+    the square root of a positive semi-definite matrix
+    """
+    values, vectors = np.linalg.eigh(matrix)
+    return (vectors * np.sqrt(np.clip(values, 0, None))).dot(vectors.T)
+
+
+def score(stats, reference):
+    """
+    compare the statistics of generated images with the ones of train data
+    :param stats: the 'ImageStats' of generated images
+    :param reference: the 'ImageStats' of train data
+    :return:
+     scores: a dict of 'frechet' and 'hist_tv', lower is better
+    """
+    # Tr(sqrt(C1 C2)) = Tr(sqrt(sqrt(C1) C2 sqrt(C1))), the latter is symmetric
+    root = sqrtm_psd(reference.cov)
+    trace_sqrt = np.sqrt(np.clip(np.linalg.eigvalsh(root.dot(stats.cov).dot(root)), 0, None)).sum()
+    frechet = (np.sum((stats.mean - reference.mean) ** 2) + np.trace(stats.cov) + np.trace(reference.cov)
+               - 2 * trace_sqrt)
+    p = stats.hist / np.maximum(stats.hist.sum(axis=1, keepdims=True), 1)
+    q = reference.hist / np.maximum(reference.hist.sum(axis=1, keepdims=True), 1)
+    hist_tv = 0.5 * np.abs(p - q).sum(axis=1).mean()
+    return {'frechet': float(max(frechet, 0.0)), 'hist_tv': float(hist_tv)}
+
+
+def get_reference(dataset, path, chunk=None, bins=None):
+    """
+    get the statistics of train data, they are computed once and saved
+    :param dataset: the 'image_util.Dataset'
+    :param path: the path of saved statistics, they are computed again if the dataset is packed from other images
+                 (see 'image_util.Dataset.fingerprint'), or the number of pixels or bins differs. they are always
+                 computed if the fingerprint of dataset is unknown
+    :param chunk: the number of images read at a time, it's 'eval_chunk' by default
+    :param bins: the number of bins of histograms, it's 'eval_bins' by default
+    :return:
+     reference: the 'ImageStats' of train data
+    """
+    chunk, bins = chunk or eval_chunk, bins or eval_bins
+    depth = dataset.shards[0].shape[-1]
+    pixels = len(dataset) * int(np.prod(dataset.shards[0].shape[1:3]))
+    source = json.dumps(dataset.fingerprint, sort_keys=True) if dataset.fingerprint is not None else ''
+    if source and os.path.exists(path):
+        reference = ImageStats.load(path)
+        if reference.source == source and reference.count == pixels and reference.hist.shape == (depth, bins):
+            return reference
+    reference = ImageStats(depth, bins)
+    reference.source = source
+    for begin in range(0, len(dataset), chunk):
+        reference.update(dataset.get_batch(np.arange(begin, min(begin + chunk, len(dataset)))))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    reference.save(path)
+    return reference
+
+
+def evaluate(generate, noise_size, reference, num=None, chunk=None, seed=0):
+    """
+    generate images in chunks and score them
+    :param generate: a function from noise [?, noise_size] to images [?, height, width, depth] in [-1, 1]
+    :param noise_size: the size of noise
+    :param reference: the 'ImageStats' of train data
+    :param num: the number of images, it's 'eval_samples' by default
+    :param chunk: the number of images generated at a time, it's 'eval_chunk' by default
+    :param seed: the seed of noise, the same noise is used every time so the scores of epochs are comparable
+    :return:
+     scores: see 'score'
+    """
+    num, chunk = num or eval_samples, chunk or eval_chunk
+    # a separated random state, so the random state of training is not changed
+    random = np.random.RandomState(seed)
+    stats = ImageStats(reference.mean.shape[0], reference.hist.shape[1])
+    for begin in range(0, num, chunk):
+        stats.update(generate(random.uniform(-1, 1, size=(min(chunk, num - begin), noise_size))))
+    return score(stats, reference)
+
+
+def best_model(log_dir, model_dir, metric=None):
+    """
+    pick the saved model whose generated images have the best score
+    :param log_dir: the directory of 'metrics.jsonl'
+    :param model_dir: the directory of models, only the epochs saved as 'model-(epoch)' are picked
+    :param metric: the score compared, it's 'eval_metric' by default
+    :return:
+     epoch: the index of the best model, None if no saved model is scored
+     scores: the scores of it
+    """
+    metric = metric or eval_metric
+    best, best_scores = None, None
+    metrics_path = os.path.join(log_dir, 'metrics.jsonl')
+    if not os.path.exists(metrics_path):
+        return None, None
+    with open(metrics_path) as f:
+        for record in map(json.loads, f):
+            if record['type'] != 'eval' or metric not in record:
+                continue
+            if not os.path.exists(os.path.join(model_dir, 'model-{}.index'.format(record['step']))):
+                continue
+            if best_scores is None or record[metric] < best_scores[metric]:
+                best, best_scores = record['step'], record
+    return best, best_scores
@@ -1,20 +1,40 @@
 import cv2
 import numpy as np
 import os
-import configparser as cfg_parser
+import json
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
 
-cp = cfg_parser.ConfigParser()
-cp.read('net.cfg')
+# the extensions of images could be read
+image_exts = ('.jpg', '.jpeg', '.png', '.bmp')
 
-read_path = cp.get('file', 'read_path')
-target_path = cp.get('file', 'target_path')
-save_path = cp.get('file', 'save_path')
-result_path = cp.get('file', 'result_path')
-repair_path = cp.get('file', 'repair_path')
-model_path = cp.get('file', 'model_path')
-image_height = cp.getint('image', 'image_height')
-image_width = cp.getint('image', 'image_width')
-image_depth = cp.getint('image', 'image_depth')
+
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global read_path, target_path, save_path, result_path, repair_path, model_path, cache_path, dataset_path, \
+        writer_threads, writer_queue, shard_size, image_height, image_width, image_depth
+    read_path = cfg.get('file', 'read_path')
+    target_path = cfg.get('file', 'target_path')
+    save_path = cfg.get('file', 'save_path')
+    result_path = cfg.get('file', 'result_path')
+    repair_path = cfg.get('file', 'repair_path')
+    model_path = cfg.get('file', 'model_path')
+    cache_path = cfg.get('file', 'cache_path')
+    dataset_path = cfg.get('file', 'dataset_path')
+    writer_threads = cfg.getint('file', 'writer_threads')
+    writer_queue = cfg.getint('file', 'writer_queue')
+    shard_size = cfg.getint('image', 'shard_size')
+    image_height = cfg.getint('image', 'image_height')
+    image_width = cfg.getint('image', 'image_width')
+    image_depth = cfg.getint('image', 'image_depth')
 
 
 def get_imgs(size):
@@ -41,34 +61,478 @@ def get_imgs(size):
             return list_img
 
 
-def get_target_img():
+def get_fingerprint(size):
+    """
+    describe the content of 'read_path' cheaply (name, size and modify time of each file), any change of the source
+    directory gives a different fingerprint, so the cache would be rebuilt.
+    :param size: how many images would be packed
+    :return: 
+     fingerprint: a dict which could be compared with the one saved in manifest of cache
+    """
+    entries = []
+    for name in sorted(os.listdir(read_path)):
+        stat = os.stat(read_path + name)
+        entries.append([name, stat.st_size, stat.st_mtime_ns])
+    digest = hashlib.sha1(json.dumps(entries).encode('utf-8')).hexdigest()
+    return {'source': os.path.abspath(read_path), 'size': size, 'digest': digest}
+
+
+def read_manifest(path):
+    """
+    read the manifest of a packed dataset
+    :param path: the directory of packed dataset
+    :return: 
+     manifest: a dict, or None if there is no (complete) dataset in this directory
+    """
+    manifest_path = os.path.join(path, 'dataset.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    """
+    write the manifest of a packed dataset. it's written after all shards, so a broken build would never be used
+    :param path: the directory of packed dataset
+    :param manifest: a dict contains 'fingerprint' and 'shards'
+    :return: 
+    """
+    tmp_path = os.path.join(path, 'dataset.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(path, 'dataset.json'))
+
+
+def close_shard(shard, count, path):
+    """
+    flush a shard filled through memory-map. If it's not full (the last one), it's trimmed to the images in it, so a
+    small dataset doesn't take a whole 'shard_size' on disk
+    :param shard: the memory-mapped shard, opened by 'np.lib.format.open_memmap'
+    :param count: the number of images in it
+    :param path: the path of shard
+    :return: 
+    """
+    shard.flush()
+    if count < len(shard):
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, shard[:count])
+        os.replace(tmp_path, path)
+
+
+def build_dataset_cache(size, fingerprint):
+    """
+    decode the images in 'read_path' once and pack them into uint8 shards(.npy) in 'cache_path'. Only one image would
+    be hold in memory at a time, the shards are filled through memory-map.
+    :param size: how many images would be packed
+    :param fingerprint: the fingerprint of 'read_path', calculated by 'get_fingerprint'
+    :return: 
+     manifest: the manifest of packed dataset
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    if os.path.exists(os.path.join(cache_path, 'dataset.json')):
+        os.remove(os.path.join(cache_path, 'dataset.json'))
+
+    imgs_path = sorted(os.listdir(read_path))[:size]
+    shards = []
+    shard, shard_file, count = None, None, 0
+    for img_path in imgs_path:
+        img = cv2.imread(read_path + img_path)
+        if img is None:
+            # not an image, skip it
+            continue
+        if img.shape != (image_height, image_width, image_depth):
+            img = cv2.resize(img, (image_width, image_height))
+        if shard is None or count == len(shard):
+            if shard is not None:
+                close_shard(shard, count, shard_file)
+                shards.append({'file': 'shard-{:05d}.npy'.format(len(shards)), 'count': count})
+            shard_file = os.path.join(cache_path, 'shard-{:05d}.npy'.format(len(shards)))
+            shard = np.lib.format.open_memmap(shard_file, mode='w+', dtype=np.uint8,
+                                              shape=(shard_size, image_height, image_width, image_depth))
+            count = 0
+        shard[count] = img
+        count += 1
+    if shard is not None:
+        close_shard(shard, count, shard_file)
+        shards.append({'file': 'shard-{:05d}.npy'.format(len(shards)), 'count': count})
+        del shard
+
+    manifest = {'fingerprint': fingerprint, 'shards': shards}
+    write_manifest(cache_path, manifest)
+    return manifest
+
+
+class Dataset(object):
+    """
+    the packed images, memory-mapped from the shards in uint8. Batches are gathered and normalized to [-1, 1] lazily,
+    so the whole dataset never lives in memory as float.
+    """
+
+    def __init__(self, shards, fingerprint=None):
+        """
+        :param shards: a list of uint8 arrays with shape [?, image_height, image_width, image_depth]
+        :param fingerprint: what the images are packed from (the fingerprint in manifest), None if it's unknown
+        """
+        self.shards = shards
+        self.fingerprint = fingerprint
+        self.offsets = np.cumsum([0] + [len(shard) for shard in shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get_batch(self, indices):
+        """
+        gather images with given indices
+        :param indices: the indices of images in dataset
+        :return: 
+         batch: float32 array with shape [len(indices), image_height, image_width, image_depth], range is [-1, 1]
+        """
+        indices = np.asarray(indices)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        batch = np.empty((len(indices),) + self.shards[0].shape[1:], dtype=np.uint8)
+        for shard_id in np.unique(shard_ids):
+            pick = shard_ids == shard_id
+            batch[pick] = self.shards[shard_id][indices[pick] - self.offsets[shard_id]]
+        # [0, 255] to [-1, 1]
+        return batch.astype(np.float32) / 127.5 - 1
+
+
+class BatchPrefetcher(object):
+    """
+    prepare the batches of train data and noise for G in a background thread, so the next batches are ready while
+    the net is optimized. Iterate it to get tuples (epoch, batch_i, batch_images, batch_noise).
+    """
+
+    def __init__(self, dataset, batch_size, noise_size, begin_epoch, end_epoch, depth, shuffle, seed=None):
+        """
+        :param dataset: the 'Dataset' of train data
+        :param batch_size: the number of images in each batch, the rest images of an epoch are dropped
+        :param noise_size: the size of input of G
+        :param begin_epoch: the first epoch
+        :param end_epoch: the epoch to stop at (not included)
+        :param depth: how many batches would be prepared in advance
+        :param shuffle: boolean, shuffle the order of images in each epoch or not
+        :param seed: the seed of random state for shuffling and noise, the random state of each epoch only depends on
+                     the seed and epoch, so the batches are the same after resuming from any epoch
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.noise_size = noise_size
+        self.begin_epoch = begin_epoch
+        self.end_epoch = end_epoch
+        self.shuffle = shuffle
+        self.seed = seed if seed is not None else np.random.randint(2 ** 31)
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            for epoch in range(self.begin_epoch, self.end_epoch):
+                random = np.random.RandomState([self.seed, epoch])
+                if self.shuffle:
+                    order = random.permutation(len(self.dataset))
+                else:
+                    order = np.arange(len(self.dataset))
+                for batch_i in range(len(self.dataset) // self.batch_size):
+                    # read the memory-mapped shards in order, the order inside a batch doesn't matter
+                    indices = np.sort(order[batch_i * self.batch_size: (batch_i + 1) * self.batch_size])
+                    batch_images = self.dataset.get_batch(indices)
+                    batch_noise = random.uniform(-1, 1, size=(self.batch_size, self.noise_size))
+                    if not self._put((epoch, batch_i, batch_images, batch_noise.astype(np.float32))):
+                        return
+            self._put(None)
+        except Exception as e:
+            # raise it in the consumer
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is None:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """
+        stop the background thread
+        :return: 
+        """
+        self.stop_event.set()
+        self.thread.join()
+
+
+def load_dataset(path, size=None):
+    """
+    memory-map the packed dataset in given directory
+    :param path: the directory of packed dataset
+    :param size: the most number of images to use, all images by default
+    :return: 
+     dataset: a 'Dataset'
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise IOError("no packed dataset in {}".format(path))
+    shards = []
+    left = size if size is not None else float('inf')
+    for shard in manifest['shards']:
+        if left <= 0:
+            break
+        count = int(min(shard['count'], left))
+        shards.append(np.load(os.path.join(path, shard['file']), mmap_mode='r')[:count])
+        left -= count
+    return Dataset(shards, manifest['fingerprint'])
+
+
+def get_dataset(size):
     """
-    get the message about image and the region prepared to repair. the range of img has been reflected to [-1, 1] here.
+    get the train data as a 'Dataset'. If 'dataset_path' is given, the dataset packed there (by 'ingest.py' or
+    'sample.py') is used as it is. Otherwise the images in 'read_path' are packed to 'cache_path' in the first time,
+    and would be packed again automatically once the content of 'read_path' changes.
+    :param size: how many images would you wanna get (for training)
+    :return: 
+     dataset: a 'Dataset', whose batches range in [-1, 1]
+    """
+    if dataset_path:
+        return load_dataset(dataset_path, size)
+    if not os.path.isdir(read_path):
+        raise IOError("no train data in {}, set 'dataset_path' to train with a packed dataset".format(read_path))
+    fingerprint = get_fingerprint(size)
+    manifest = read_manifest(cache_path)
+    if manifest is None or manifest['fingerprint'] != fingerprint:
+        print("packing images in {} to {}".format(read_path, cache_path))
+        build_dataset_cache(size, fingerprint)
+    return load_dataset(cache_path)
+
+
+def get_target_paths(path):
+    """
+    list the images prepared to repair.
+    :param path: the path of an image, a directory of images, or several of them separated by ','
+    :return: 
+     paths: a list of paths of images, the masks (see 'get_mask_path') are excluded
+    """
+    paths = []
+    for each_path in path.split(','):
+        each_path = each_path.strip()
+        if os.path.isdir(each_path):
+            for name in sorted(os.listdir(each_path)):
+                name_path = os.path.join(each_path, name)
+                if name.lower().endswith(image_exts) and not name_path.endswith(get_mask_path('')):
+                    paths.append(name_path)
+        elif each_path:
+            paths.append(each_path)
+    return paths
+
+
+def get_result_names(paths):
+    """
+    the names of results of images, the name of file without extension. if several images have the same name (in
+    different directories), the directories below their common one are prefixed, e.g. 'a/x.jpg' and 'b/x.jpg' are
+    named 'a_x' and 'b_x', so their results don't overwrite each other
+    :param paths: the paths of images prepared to repair
+    :return: 
+     names: a list of names
+    """
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    duplicated = [i for i, name in enumerate(names) if names.count(name) > 1]
+    if duplicated:
+        common = os.path.commonpath([os.path.dirname(os.path.abspath(paths[i])) for i in duplicated])
+        for i in duplicated:
+            names[i] = os.path.relpath(os.path.splitext(os.path.abspath(paths[i]))[0], common).replace(os.sep, '_')
+    for name in set(names):
+        if names.count(name) > 1:
+            raise ValueError("the results of {} would overwrite each other".format(
+                ', '.join(path for path, each in zip(paths, names) if each == name)))
+    return names
+
+
+def get_mask_path(path):
+    """
+    the mask of an image is saved beside it, e.g. the mask of 'xxx.jpg' is 'xxx_mask.png' (or 'xxx_mask.txt')
+    :param path: the path of image prepared to repair
+    :return: 
+     mask_path: the path of its mask
+    """
+    return os.path.splitext(path)[0] + '_mask.png'
+
+
+def get_target_img(path=None):
+    """
+    get the image prepared to repair. the range of img has been reflected to [-1, 1] here.
+    :param path: the path of image prepared to repair, it's 'target_path' by default
     :return: 
      img: the image prepared to repair
-     repair: a list shows the regions prepared to repair in img, with [[begin, end], [begin, end], ...] 
     """
-    img = cv2.imread(target_path)
+    img = cv2.imread(path or target_path)
     img = img/255
     img = img * 2 - 1
-    repair = []
-    for i in range(3):
-        repair.append([(15 + i) * 64 + 20, (15 + i) * 64 + 30])
-    return img, repair
+    return img
+
+
+def get_mask(spec, shape=None):
+    """
+    get the mask from the description of regions prepared to repair.
+     what's the mask:the matrix has the same shape of image. but the value of each vector either 0 or 1. the value of 
+     Those area prepared to repair is 1 while those constant area should be set as 0. 
+    :param spec: the path of a mask image, whose white pixels are prepared to repair. Or regions separated by ';', each
+                 one is a rectangle 'rect x0 y0 x1 y1' (x1 and y1 are not included) or a polygon 'poly x0 y0 x1 y1 ...'
+    :param shape: (height, width) of mask, it's (image_height, image_width) by default
+    :return: 
+     mask: float32 array with shape [height, width, image_depth]
+    """
+    height, width = shape or (image_height, image_width)
+    if os.path.exists(spec):
+        mask = cv2.imread(spec, cv2.IMREAD_GRAYSCALE)
+        mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        mask = (mask > 127).astype(np.uint8)
+    else:
+        mask = np.zeros([height, width], dtype=np.uint8)
+        for region in spec.split(';'):
+            region = region.split()
+            if not region:
+                continue
+            kind, coords = region[0], [int(each) for each in region[1:]]
+            if kind == 'rect' and len(coords) == 4:
+                x0, y0, x1, y1 = coords
+                mask[y0:y1, x0:x1] = 1
+            elif kind == 'poly' and len(coords) >= 6 and len(coords) % 2 == 0:
+                cv2.fillPoly(mask, [np.array(coords, dtype=np.int32).reshape(-1, 2)], 1)
+            else:
+                raise ValueError("unknown region '{}' in mask".format(' '.join(region)))
+    return np.repeat(mask[:, :, np.newaxis], image_depth, axis=2).astype(np.float32)
+
+
+def get_target_mask(path, default, shape=None):
+    """
+    get the mask of image prepared to repair, it's given by the file beside the image (see 'get_mask_path'), which 
+    could be a mask image, or a text file with regions described as 'get_mask'.
+    :param path: the path of image prepared to repair
+    :param default: the description of regions used if the image has no mask file
+    :param shape: (height, width) of mask, it's (image_height, image_width) by default
+    :return: 
+     mask: float32 array with shape [height, width, image_depth]
+    """
+    mask_path = get_mask_path(path)
+    if os.path.exists(mask_path):
+        return get_mask(mask_path, shape)
+    spec_path = os.path.splitext(mask_path)[0] + '.txt'
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            return get_mask(f.read().replace('\n', ';'), shape)
+    return get_mask(default, shape)
+
+
+class ImageWriter(object):
+    """
+    encode and write images in background threads, so the training or repairing is not blocked by the disk. At most
+    'capacity' images could wait in queue, 'write' blocks until there is a free place. 'close' waits for all images.
+    The first error of writing is raised by the next 'write' and by 'close'.
+    """
+
+    def __init__(self, threads=None, capacity=None):
+        """
+        :param threads: the number of threads writing images, 'writer_threads' by default
+        :param capacity: the number of images could wait in queue, 'writer_queue' by default
+        """
+        self.pool = ThreadPoolExecutor(max_workers=threads or writer_threads)
+        self.slots = threading.BoundedSemaphore(capacity or writer_queue)
+        self.error = None
+
+    def write(self, path, img):
+        """
+        write an image in background
+        :param path: the path of image
+        :param img: the image, with range [0, 255]. it shouldn't be changed later
+        :return: 
+        """
+        if self.error is not None:
+            raise self.error
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(self._write, path, img)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    @staticmethod
+    def _write(path, img):
+        if not cv2.imwrite(path, np.clip(img, 0, 255).astype(np.uint8)):
+            raise IOError("can't write image to {}".format(path))
+
+    def _done(self, future):
+        self.slots.release()
+        # only the first error is kept, the later ones are likely caused by the same problem
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+
+    def close(self):
+        """
+        wait for all images written, and raise the first error if any
+        :return: 
+        """
+        self.pool.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def contact_sheet(imgs, cols=None):
+    """
+    tile images to one image
+    :param imgs: the images with shape [?, height, width, depth]
+    :param cols: the number of images in each row, about sqrt(len(imgs)) by default
+    :return: 
+     sheet: the image with shape [rows * height, cols * width, depth]
+    """
+    n, height, width, depth = imgs.shape
+    cols = cols or int(np.ceil(np.sqrt(n)))
+    rows = (n + cols - 1) // cols
+    tiles = np.zeros((rows * cols, height, width, depth), dtype=imgs.dtype)
+    tiles[:n] = imgs
+    tiles = tiles.reshape(rows, cols, height, width, depth).transpose(0, 2, 1, 3, 4)
+    return tiles.reshape(rows * height, cols * width, depth)
 
 
-def plot_images(epoch_time, samples):
+def plot_images(epoch_time, samples, writer=None, sheet=False):
     """
     Save the images generated by G 
     :param epoch_time: G has finished several epoch.
     :param samples: A number of images wanted to generate
+    :param writer: the 'ImageWriter' to write images in background, they are written immediately if it's None
+    :param sheet: boolean, save the images tiled as one image 'img_(epoch_time).jpg' or not
     :return: 
     """
     # [-1 ,1] to [0 ,1]
     samples = (samples + 1) / 2
+    imwrite = writer.write if writer is not None else cv2.imwrite
+    if sheet:
+        imwrite(result_path + 'img_' + str(epoch_time) + '.jpg', contact_sheet(samples * 255))
+        return
     index = 0
     for img in samples:
-        cv2.imwrite(result_path + 'img_' + str(epoch_time) + '_' + str(index) + '.jpg', img * 255)
+        imwrite(result_path + 'img_' + str(epoch_time) + '_' + str(index) + '.jpg', img * 255)
         index += 1
 
 
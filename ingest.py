@@ -0,0 +1,151 @@
+"""
+Build the train data from videos in one pass. Only the frames wanted are retrieved, they are cropped and resized in
+a pool of threads ('cv2.resize' releases the GIL, and the frames are not copied to other processes), and written into
+the shards of packed dataset (see 'image_util.load_dataset') directly. At most 'max_pending' frames are held in
+memory.
+"""
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import image_util
+
+
+def read_frames(paths, every, seek):
+    """
+    read one frame in every 'every' frames of videos
+    :param paths: the paths of videos
+    :param every: keep one frame in every 'every' frames
+    :param seek: boolean, jump to the next frame wanted by seeking, instead of grabbing the frames between. it's faster
+                 for a large 'every' if the video seeks well
+    :return:
+     a generator of frames
+    """
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError("can't open video {}".format(path))
+        i = 0
+        try:
+            while True:
+                if seek and i > 0:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+                # 'grab' may decode the frame already (e.g. by FFmpeg), only converting it to an image is left to
+                # 'retrieve', so it's skipped for the frames not wanted
+                if not cap.grab():
+                    break
+                if i % every == 0:
+                    success, frame = cap.retrieve()
+                    if success:
+                        yield frame
+                    if seek:
+                        i += every
+                        continue
+                i += 1
+        finally:
+            cap.release()
+
+
+def crop_frames(frames, crop):
+    """
+    :param frames: an iterable of frames
+    :param crop: [top, bottom, left, right] of the area kept, or None
+    :return:
+     a generator of the cropped frames, they are views of the frames
+    """
+    for frame in frames:
+        if crop is not None:
+            top, bottom, left, right = crop
+            frame = frame[top:bottom, left:right]
+        yield frame
+
+
+def process_frame(frame):
+    """
+    resize a frame to (image_height, image_width)
+    :param frame: the cropped frame
+    :return:
+     img: uint8 array with shape [image_height, image_width, image_depth]
+    """
+    return cv2.resize(frame, (image_util.image_width, image_util.image_height), interpolation=cv2.INTER_AREA)
+
+
+def bounded_map(pool, func, items, max_pending):
+    """
+    like 'pool.map', but no more than 'max_pending' items are read ahead
+    :param pool: the 'ThreadPoolExecutor'
+    :param func: the function applied to each item
+    :param items: an iterable of items
+    :param max_pending: the most number of items being processed
+    :return:
+     a generator of results, in the order of items
+    """
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(pool.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def ingest(paths, out=None, every=6, crop=None, workers=None, max_pending=None, seek=False):
+    """
+    build the train data from videos
+    :param paths: the paths of videos
+    :param out: the directory of packed dataset, it's 'dataset_path' by default, or './dataset/' if it's empty
+    :param every: keep one frame in every 'every' frames
+    :param crop: [top, bottom, left, right] of the area kept in each frame, the whole frame by default
+    :param workers: the number of threads, the number of cores by default
+    :param max_pending: the most number of frames held in memory, 4 times of workers by default
+    :param seek: boolean, see 'read_frames'
+    :return:
+     count: the number of images
+    """
+    out = out or image_util.dataset_path or './dataset/'
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or workers * 4
+    os.makedirs(out, exist_ok=True)
+    if os.path.exists(os.path.join(out, 'dataset.json')):
+        os.remove(os.path.join(out, 'dataset.json'))
+
+    shape = (image_util.shard_size, image_util.image_height, image_util.image_width, image_util.image_depth)
+    shards = []
+    shard, shard_file, count, total = None, None, 0, 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        frames = crop_frames(read_frames(paths, every, seek), crop)
+        for img in bounded_map(pool, process_frame, frames, max_pending):
+            if shard is None or count == len(shard):
+                if shard is not None:
+                    image_util.close_shard(shard, count, shard_file)
+                    shards.append({'file': 'shard-{:05d}.npy'.format(len(shards)), 'count': count})
+                shard_file = os.path.join(out, 'shard-{:05d}.npy'.format(len(shards)))
+                shard = np.lib.format.open_memmap(shard_file, mode='w+', dtype=np.uint8, shape=shape)
+                count = 0
+            shard[count] = img
+            count += 1
+            total += 1
+            if total % 1000 == 0:
+                print("{} images are ingested".format(total))
+    finally:
+        pool.shutdown(wait=True)
+    if shard is not None:
+        image_util.close_shard(shard, count, shard_file)
+        shards.append({'file': 'shard-{:05d}.npy'.format(len(shards)), 'count': count})
+        del shard
+
+    fingerprint = {'source': 'ingest', 'videos': [os.path.abspath(path) for path in paths], 'every': every,
+                   'crop': crop}
+    image_util.write_manifest(out, {'fingerprint': fingerprint, 'shards': shards})
+    print("{} images are ingested to {}".format(total, out))
+    if os.path.abspath(out) != os.path.abspath(image_util.dataset_path or '.'):
+        print("set 'dataset_path = {}' in [file] to train with them".format(out))
+    return total
+
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    cli.main(['ingest'] + sys.argv[1:])
@@ -0,0 +1,213 @@
+"""
+An index of noises with thumbnails of the images G generates from them. Repairing starts from the noises whose images
+are nearest to the constant area of the target, instead of random noise, so it needs much fewer epochs.
+"""
+import os
+import numpy as np
+import image_util
+
+
+class LatentIndex(object):
+    """
+    the noises [?, noise_size] (float32) and the thumbnails of their images [?, thumb_size * thumb_size * depth]
+    (uint8).
+    if 'max_entries' is given, it's a ring buffer: once it's full, the oldest entries are replaced by the new ones.
+    """
+
+    def __init__(self, latents, thumbs, thumb_size, max_entries=0, model=''):
+        """
+        :param latents: the noises, with shape [?, noise_size], the older first
+        :param thumbs: the thumbnails calculated by 'thumbnail', with shape [?, thumb_size * thumb_size * depth]
+        :param thumb_size: the height and width of thumbnails
+        :param max_entries: the most number of entries kept, 0 means no limit
+        :param model: the fingerprint of the model generating the images (see 'checkpoint.model_fingerprint')
+        """
+        latents = np.asarray(latents, dtype=np.float32)
+        thumbs = np.asarray(thumbs, dtype=np.uint8)
+        if max_entries:
+            latents, thumbs = latents[-max_entries:], thumbs[-max_entries:]
+        # the arrays grow geometrically, only the first 'count' entries are used
+        self._latents = latents.copy()
+        self._thumbs = thumbs.copy()
+        self.count = len(latents)
+        self.thumb_size = thumb_size
+        self.max_entries = max_entries
+        self.model = model
+        # the position of the oldest entry once it's full
+        self.oldest = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def latents(self):
+        return self._latents[:self.count]
+
+    @property
+    def thumbs(self):
+        return self._thumbs[:self.count]
+
+    def _reserve(self, size):
+        if size <= len(self._latents):
+            return
+        capacity = max(size, 2 * len(self._latents))
+        if self.max_entries:
+            capacity = min(capacity, self.max_entries)
+        latents = np.zeros((capacity,) + self._latents.shape[1:], dtype=np.float32)
+        thumbs = np.zeros((capacity,) + self._thumbs.shape[1:], dtype=np.uint8)
+        latents[:self.count] = self.latents
+        thumbs[:self.count] = self.thumbs
+        self._latents, self._thumbs = latents, thumbs
+
+    def thumbnail(self, imgs):
+        """
+        shrink images by averaging the blocks of pixels
+        :param imgs: the images with shape [?, image_height, image_width, depth], the range is [0, 1]
+        :return:
+         thumbs: float32 array with shape [?, thumb_size * thumb_size * depth], the range is [0, 1]
+        """
+        n, height, width, depth = imgs.shape
+        size = self.thumb_size
+        blocks = np.asarray(imgs, dtype=np.float32).reshape(n, size, height // size, size, width // size, depth)
+        return blocks.mean(axis=(2, 4)).reshape(n, -1)
+
+    def add(self, latents, imgs):
+        """
+        add noises and the images generated from them, the oldest entries are replaced if it's full
+        :param latents: the noises, with shape [?, noise_size]
+        :param imgs: the images generated by G, the range is [0, 1]
+        :return:
+        """
+        latents = np.asarray(latents, dtype=np.float32)
+        thumbs = np.clip(np.rint(self.thumbnail(imgs) * 255), 0, 255).astype(np.uint8)
+        if self.max_entries:
+            latents, thumbs = latents[-self.max_entries:], thumbs[-self.max_entries:]
+        fill = min(len(latents), self.max_entries - self.count) if self.max_entries else len(latents)
+        replace = len(latents) - fill
+        positions = np.concatenate([np.arange(self.count, self.count + fill),
+                                    (self.oldest + np.arange(replace)) % max(self.max_entries, 1)]).astype(np.int64)
+        self._reserve(self.count + fill)
+        self.count += fill
+        if replace:
+            self.oldest = (self.oldest + replace) % self.max_entries
+        self._latents[positions] = latents
+        self._thumbs[positions] = thumbs
+
+    def search(self, imgs, masks, k, chunk=65536):
+        """
+        find the k noises whose images are nearest to each image, only the constant area (mask is 0) is compared:
+            distance = sum{known * (thumb - target) ^ 2} = thumb^2 . known - 2 * thumb . (known * target) + const
+        known is 1 only for the thumbnail cells entirely outside the mask. a cell touching the mask averages damaged
+        pixels into the target (and the area to repair into the thumbnails), so it's not compared at all
+        :param imgs: the images prepared to repair, with shape [?, image_height, image_width, depth], the range is
+                     [0, 1]
+        :param masks: the masks of imgs, the area prepared to repair is 1
+        :param k: the number of neighbours of each image
+        :param chunk: the number of noises compared at a time
+        :return:
+         latents: the noises with shape [len(imgs), k, noise_size], nearer first
+         distances: the distances with shape [len(imgs), k]
+        """
+        known = (self.thumbnail(np.asarray(masks)) == 0).astype(np.float32)
+        targets = self.thumbnail(imgs) * known
+        const = (targets * targets).sum(axis=1)
+        k = min(k, len(self), chunk)
+        if k == 0:
+            return np.zeros((len(imgs), 0, self.latents.shape[1]), dtype=np.float32), np.zeros((len(imgs), 0))
+
+        best_distances = np.full((len(imgs), 0), np.inf, dtype=np.float32)
+        best_indices = np.zeros((len(imgs), 0), dtype=np.int64)
+        for begin in range(0, len(self), chunk):
+            thumbs = self.thumbs[begin: begin + chunk].astype(np.float32) / 255
+            distances = (thumbs * thumbs).dot(known.T) - 2 * thumbs.dot(targets.T) + const
+            distances = np.concatenate([best_distances, distances.T], axis=1)
+            indices = np.concatenate([best_indices, np.broadcast_to(np.arange(begin, begin + len(thumbs)),
+                                                                    (len(imgs), len(thumbs)))], axis=1)
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(distances, top, axis=1)
+            best_indices = np.take_along_axis(indices, top, axis=1)
+
+        order = np.argsort(best_distances, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        return self.latents[best_indices], np.take_along_axis(best_distances, order, axis=1)
+
+    def save(self, path):
+        """
+        save the index as .npz
+        :param path: the path of index
+        :return:
+        """
+        tmp_path = path + '.tmp.npz'
+        # the older first, so the oldest are still replaced first after loading
+        order = (self.oldest + np.arange(self.count)) % max(self.count, 1)
+        np.savez(tmp_path, latents=self.latents[order], thumbs=self.thumbs[order], thumb_size=self.thumb_size,
+                 model=self.model)
+        os.replace(tmp_path, path)
+
+
+def load(path, noise_size, thumb_size, max_entries=0, model=''):
+    """
+    load the index, or create an empty one if it doesn't exist
+    :param path: the path of index
+    :param noise_size: the size of noise
+    :param thumb_size: the height and width of thumbnails
+    :param max_entries: the most number of entries kept, 0 means no limit
+    :param model: the fingerprint of the model in use (see 'checkpoint.model_fingerprint'). the noises of another
+                  model mean nothing to it, so an index built from another model is not used
+    :return:
+     index: the 'LatentIndex', None if it's built from another model
+    """
+    if not os.path.exists(path):
+        index = LatentIndex(np.zeros((0, noise_size)), np.zeros((0, thumb_size * thumb_size * image_util.image_depth)),
+                            thumb_size, max_entries, model)
+    else:
+        with np.load(path) as data:
+            # the indexes saved before the model was recorded have no 'model'
+            saved_model = str(data['model']) if 'model' in data.files else ''
+            if saved_model != model:
+                print("the index {} is built from {}, not {}, it's not used".format(
+                    path, saved_model or 'an unknown model', model))
+                return None
+            index = LatentIndex(data['latents'], data['thumbs'], int(data['thumb_size']), max_entries, model)
+    if image_util.image_height % index.thumb_size or image_util.image_width % index.thumb_size:
+        raise ValueError("image {}x{} is not divisible by thumbnails {}x{}".format(
+            image_util.image_height, image_util.image_width, index.thumb_size, index.thumb_size))
+    return index
+
+
+def build(path, num, batch, thumb_size, random_seed=0, max_entries=0):
+    """
+    add noises to the index by sampling the frozen G (see 'sample.export')
+    :param path: the path of index
+    :param num: the number of noises to add
+    :param batch: the number of images generated in each run
+    :param thumb_size: the height and width of thumbnails
+    :param random_seed: the seed of noise
+    :param max_entries: the most number of entries kept, 0 means no limit
+    :return:
+    """
+    import sample
+    random = np.random.RandomState(random_seed)
+    sess, noise, samples = sample.load_frozen()
+    try:
+        try:
+            model = sess.run(sess.graph.get_tensor_by_name('model:0')).decode('utf-8')
+        except KeyError:
+            raise ValueError("the frozen G has no fingerprint of model, export it again")
+        index = load(path, int(noise.shape[1]), thumb_size, max_entries, model)
+        if index is None:
+            raise ValueError("the index {} is built from another model, remove it or change 'index_path'".format(path))
+        for begin in range(0, num, batch):
+            batch_noise = random.uniform(-1, 1, size=(min(batch, num - begin), int(noise.shape[1])))
+            # [-1, 1] to [0, 1]
+            index.add(batch_noise, (sess.run(samples, feed_dict={noise: batch_noise}) + 1) / 2)
+            print("{} noises are in index".format(len(index)))
+    finally:
+        sess.close()
+    index.save(path)
+
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    cli.main(['index'] + sys.argv[1:])
@@ -1,127 +1,424 @@
 import os
 import cly_dcgan as GAN
 import numpy as np
-import cv2
 import tensorflow as tf
 import image_util
-import configparser as cfg_parser
+import latent_index
+import checkpoint
+import evaluate
+import config
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
 
-cp = cfg_parser.ConfigParser()
-cp.read('net.cfg')
 
-epochs = cp.getint('repair', 'epochs')
-learning_rate = cp.getfloat('repair', 'learning_rate')
-beta = cp.getfloat('repair', 'beta')
-break_time = cp.getfloat('repair', 'break_time')
-threshold = cp.getfloat('repair', 'threshold')
-model_index = cp.getfloat('repair', 'model_index')
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global epochs, learning_rate, beta, break_time, threshold, mask, model_index, batch_size, restarts, prune_epoch, \
+        prune_ratio, patience, min_delta, folded, tiled, tile_stride, debug_graph, index_path, index_thumb, \
+        index_learn, index_max
+    epochs = cfg.getint('repair', 'epochs')
+    learning_rate = cfg.getfloat('repair', 'learning_rate')
+    beta = cfg.getfloat('repair', 'beta')
+    break_time = cfg.getint('repair', 'break_time')
+    threshold = cfg.getfloat('repair', 'threshold')
+    mask = cfg.get('repair', 'mask')
+    model_index = cfg.get('repair', 'model_index')
+    batch_size = cfg.getint('repair', 'batch_size')
+    restarts = cfg.getint('repair', 'restarts')
+    prune_epoch = cfg.getint('repair', 'prune_epoch')
+    prune_ratio = cfg.getfloat('repair', 'prune_ratio')
+    patience = cfg.getint('repair', 'patience')
+    min_delta = cfg.getfloat('repair', 'min_delta')
+    folded = cfg.getboolean('repair', 'folded')
+    tiled = cfg.getboolean('repair', 'tiled')
+    tile_stride = cfg.getint('repair', 'tile_stride')
+    debug_graph = cfg.getboolean('repair', 'debug_graph')
+    index_path = cfg.get('repair', 'index_path')
+    index_thumb = cfg.getint('repair', 'index_thumb')
+    index_learn = cfg.getboolean('repair', 'index_learn')
+    index_max = cfg.getint('repair', 'index_max')
 
 
-def init_target():
+def init_target(batch):
     """
-    get the mask of target image according to the area to be repaired. save mask and target image as  variables
-     what's the mask:the matrix has the same shape of image. but the value of each vector either 0 or 1. the value of 
-     Those area prepared to repair is 1 while those constant area should be set as 0. 
-    :return: 
+    save the target images and their masks as variables, they are loaded by feeding the placeholders to 'load_op', so
+    the same graph could repair any number of batches.
+     what's the mask:the matrix has the same shape of image. but the value of each vector either 0 or 1. the value of
+     Those area prepared to repair is 1 while those constant area should be set as 0.
+    :param batch: the number of images repaired together
+    :return:
+     image_holder: the placeholder of target images, with shape [batch, image_height, image_width, image_depth]
+     mask_holder: the placeholder of masks, with the same shape as image_holder
+     load_op: the op assigning the placeholders to variables
     """
+    shape = [batch, GAN.image_height, GAN.image_width, GAN.image_depth]
     # the scope would save the variables of mask and image
     with tf.variable_scope("target"):
-        target_img, target_area = image_util.get_target_img()
-        target_img = target_img.astype('float32')
-
-        # cal the mask from target_area
-        mask = np.zeros([GAN.image_width, GAN.image_height, GAN.image_depth], dtype=np.float32)
-        for each_area in range(len(target_area)):
-            for each_pixel in range(target_area[each_area][0], target_area[each_area][1]):
-                for dim in range(GAN.image_depth):
-                    mask[each_pixel // GAN.image_width][each_pixel % GAN.image_width][dim] = 1
+        image = tf.get_variable("image", shape, initializer=tf.zeros_initializer(), trainable=False)
+        mask = tf.get_variable("mask", shape, initializer=tf.zeros_initializer(), trainable=False)
+        image_holder = tf.placeholder(tf.float32, shape, name="image_holder")
+        mask_holder = tf.placeholder(tf.float32, shape, name="mask_holder")
+        load_op = tf.group(tf.assign(image, image_holder), tf.assign(mask, mask_holder))
+    return image_holder, mask_holder, load_op
 
-        # save in scope
-        tf.get_variable("image", [GAN.image_height, GAN.image_width, GAN.image_depth],
-                        initializer=tf.constant_initializer(target_img))
-        tf.get_variable("mask", [GAN.image_height, GAN.image_width, GAN.image_depth],
-                        initializer=tf.constant_initializer(mask))
 
-
-def get_repair_loss(inputs_noise, reuse):
+def get_repair_loss(images):
     """
     we define the the loss of repair with formula:
         loss = sum{max(abs(G_x - Target_x), threshold) - threshold) for x in pixels of constant area}
-        
-    :param inputs_noise: the input of G (random noise)
-    :param reuse: reuse the frame of G ? (we have created the structure in 'dcgan')
-    :return:  
-     the defination of loss
+    the pixels differ less than 'threshold' are regarded as the same, so they don't pull the noise any more.
+    the images in batch are independent, so minimizing the sum of them is the same as minimizing each one.
+
+    :param images: the images calculated by 'get_images'
+    :return:
+     the defination of loss, with shape [?], one for each image
     """
-    combine, generate_image, _ = get_images(inputs_noise, reuse)
-    loss = tf.reduce_sum(tf.abs(tf.abs(combine - generate_image)))
+    combine, generate_image, _ = images
+    # combine and generate_image only differ in the constant area
+    loss = tf.nn.relu(tf.abs(combine - generate_image) - threshold)
+    loss = tf.reduce_sum(loss, axis=[1, 2, 3])
     return loss
 
 
-def get_images(inputs_noise, reuse):
+def get_images(inputs_noise, reuse, indices=None, weights=None):
     """
     get corresponding images
     :param inputs_noise: the input of G (random noise)
     :param reuse: reuse the frame of G ? (we have created the structure in 'dcgan')
-    :return: 
+    :param indices: the indices of target images matched with inputs_noise, all target images by default
+    :param weights: the weights of G with BN folded (see 'GAN.fold_generator'), the folded G is used if it's given
+    :return:
      return three images,they are:
      combine: repaired image (combine the generated image and target image )
      generate_image: the image generated by G
      int_image: the image similar to target image but those areas to be repaired is filled with black
     """
-    g_outputs = GAN.get_generator(inputs_noise, False, reuse)
+    if weights is not None:
+        g_outputs = GAN.get_folded_generator(inputs_noise, weights)
+    else:
+        g_outputs = GAN.get_generator(inputs_noise, False, reuse)
     # reflect the output of G from [-1, 1] to [0, 1]
     generate_image = tf.multiply(tf.add(g_outputs, tf.constant(1.0)), tf.constant(0.5))
 
     with tf.variable_scope("target", reuse=True):
         # target image
         ready_image = tf.get_variable("image")
+        mask = tf.get_variable("mask")
+        if indices is not None:
+            ready_image = tf.gather(ready_image, indices)
+            mask = tf.gather(mask, indices)
         # reflect the target image from [-1, 1] to [0, 1]
         ready_image = tf.multiply(tf.add(ready_image, tf.constant(1.0)), tf.constant(0.5))
         # cut the areas to be repaired from generated image
-        part_repair = tf.multiply(generate_image, tf.get_variable("mask"))
+        part_repair = tf.multiply(generate_image, mask)
         # get the int_image. do operation : (1-mask) & target image
-        int_image = tf.multiply(ready_image, tf.subtract(tf.constant(1.0), tf.get_variable("mask")))
+        int_image = tf.multiply(ready_image, tf.subtract(tf.constant(1.0), mask))
     # put the area cut from G to the black area of int_image, that's the repaired image
     combine = tf.add(part_repair, int_image)
     return combine, generate_image, int_image
 
 
-def repair():
+class Repairer(object):
     """
-    do repairing
-    :return: 
+    the graph of repairing a batch of images. G is restored from model file only once, then any number of batches
+    could be repaired in the same session, one optimization run for each batch.
+    the result depends heavily on the initial noise, so 'restarts' candidates of noise are optimized for each image
+    together, and the one with least loss is picked. Only the candidates still alive are sent to G: the worse part of
+    candidates are pruned at 'prune_epoch', and an image stops once its loss doesn't decrease in 'patience' epochs.
+    if 'folded' is set, G is built with BN folded into constants, which is much faster for the hundreds of passes.
+    if a 'latent_index.LatentIndex' is given, the candidates start from the noises whose images are nearest to the
+    target instead of random noise.
     """
-    inputs_noise = np.random.uniform(1, -1, size=(1, GAN.noise_size))
-    inputs_noise = tf.Variable(inputs_noise.astype('float32'), name="input_noise")
-    repair_loss = get_repair_loss(inputs_noise, False)
-    # use Adam
-    repiar_opt = tf.train.AdamOptimizer(learning_rate, beta).minimize(repair_loss, var_list=inputs_noise)
 
-    with tf.Session() as sess:
-        sess.run(tf.global_variables_initializer())
-        # recover the structure of G from model file
-        g_scope = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='generator')
-        saver = tf.train.Saver(g_scope)
-        saver.restore(sess, image_util.model_path + 'model-{}'.format(model_index))
+    def __init__(self, batch, index, noise_index=None):
+        """
+        :param batch: the number of images repaired together
+        :param index: the index of model used for repairing
+        :param noise_index: the 'latent_index.LatentIndex' for the initial noise, random noise is used if it's None
+        """
+        self.batch = batch
+        self.noise_index = noise_index
+        rows = batch * restarts
+        model_file = image_util.model_path + 'model-{}'.format(index)
+        weights = GAN.fold_generator(model_file) if folded else None
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.image_holder, self.mask_holder, self.load_target = init_target(rows)
+            self.inputs_noise = tf.get_variable("input_noise", [rows, GAN.noise_size],
+                                                initializer=tf.zeros_initializer())
+            self.noise_holder = tf.placeholder(tf.float32, [rows, GAN.noise_size], name="noise_holder")
+            self.load_noise = tf.assign(self.inputs_noise, self.noise_holder)
+
+            # the indices of candidates alive, the others are not calculated
+            self.active = tf.placeholder(tf.int32, [None], name="active")
+            # it's read before updating, so it matches the loss fetched in the same step
+            self.active_noise = tf.gather(self.inputs_noise, self.active)
+            self.images = get_images(self.active_noise, False, self.active, weights)
+            self.repair_loss = get_repair_loss(self.images)
+            # use Adam
+            self.repair_opt = tf.train.AdamOptimizer(learning_rate, beta).minimize(tf.reduce_sum(self.repair_loss),
+                                                                                  var_list=[self.inputs_noise])
+            # recover the structure of G from model file, the moving mean and variance of BN are also needed
+            g_scope = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='generator')
+            saver = tf.train.Saver(g_scope) if g_scope else None
+            # the state of Adam should be reset for each batch
+            self.reset = tf.variables_initializer([var for var in tf.global_variables() if var not in g_scope])
+            # nothing could be added to the graph in the loop
+            self.graph.finalize()
+            self.op_count = len(self.graph.get_operations())
+
+        self.sess = tf.Session(graph=self.graph, config=GAN.get_session_config())
+        if saver is not None:
+            saver.restore(self.sess, model_file)
 
+    def repair(self, imgs, masks, on_snapshot=None):
+        """
+        repair a batch of images
+        :param imgs: the images prepared to repair, with shape [?, image_height, image_width, image_depth], the range is
+                     [-1, 1]. there should be no more than 'batch' images.
+        :param masks: the masks of imgs, with the same shape as imgs
+        :param on_snapshot: a function called after each 'break_time' epochs, with (epoch, loss, images)
+        :return:
+         repaired_img, generate_img, init_img: the images calculated by 'get_images', the range is [0, 1]
+         loss: the loss of each repaired image
+        """
+        n = len(imgs)
+        # candidates of the i-th image are in rows [i * restarts, (i + 1) * restarts)
+        # fill the batch by repeating the last image, they are never alive
+        pad = [n - 1] * (self.batch - n)
+        imgs = np.repeat(np.concatenate([imgs, np.asarray(imgs)[pad]]), restarts, axis=0).astype(np.float32)
+        masks = np.repeat(np.concatenate([masks, np.asarray(masks)[pad]]), restarts, axis=0).astype(np.float32)
+        inputs_noise = np.random.uniform(1, -1, size=(len(imgs), GAN.noise_size)).astype(np.float32)
+        if self.noise_index is not None and len(self.noise_index) > 0:
+            # the nearest noises replace the random ones, the rest are random if the index is small
+            # reflect the target image from [-1, 1] to [0, 1]
+            neighbours, _ = self.noise_index.search((imgs[:n * restarts:restarts] + 1) / 2,
+                                                    masks[:n * restarts:restarts], restarts)
+            inputs_noise.reshape(self.batch, restarts, -1)[:n, :neighbours.shape[1]] = neighbours
+
+        self.sess.run(self.reset)
+        self.sess.run([self.load_target, self.load_noise],
+                      feed_dict={self.image_holder: imgs, self.mask_holder: masks, self.noise_holder: inputs_noise})
+
+        offsets = np.arange(n) * restarts
+        alive = np.zeros(len(imgs), dtype=bool)
+        alive[:n * restarts] = True
+        best_loss = np.full(len(imgs), np.inf)
+        best_noise = inputs_noise
+        # the loss of each image when it decreased last time, and when
+        last_loss = np.full(n, np.inf)
+        last_epoch = np.zeros(n, dtype=int)
         for epoch in range(epochs):
-            sess.run(repiar_opt)
-            if epoch % break_time == 0:
-                print("in {}, loss:{}".format(epoch, sess.run(repair_loss)))
-                repaired_img, generate_img, init_img = sess.run(get_images(inputs_noise, True))
-                # reflect the value from [0,1] to [0,255]
-                repaired_img = repaired_img[0] * 255
-                generate_img = generate_img[0] * 255
-                init_img = init_img * 255
-                # save
-                cv2.imwrite(image_util.repair_path + str(epoch) + '{}_repair.jpg'.format(epoch), repaired_img)
-                cv2.imwrite(image_util.repair_path + str(epoch) + '{}_generate.jpg'.format(epoch), generate_img)
-                cv2.imwrite(image_util.repair_path + 'init_img.jpg', init_img)
-
-
-with tf.Graph().as_default():
-    init_target()
-    repair()
+            active = np.flatnonzero(alive)
+            if len(active) == 0:
+                break
+            _, loss, noise = self.sess.run([self.repair_opt, self.repair_loss, self.active_noise],
+                                           feed_dict={self.active: active})
+            improved = loss < best_loss[active]
+            best_loss[active[improved]] = loss[improved]
+            best_noise[active[improved]] = noise[improved]
+
+            candidate_loss = best_loss[:n * restarts].reshape(n, restarts)
+            image_loss = candidate_loss.min(axis=1)
+            decreased = image_loss < last_loss * (1 - min_delta)
+            last_loss[decreased] = image_loss[decreased]
+            last_epoch[decreased] = epoch
+            if patience > 0:
+                # stop the images which have converged
+                alive[:n * restarts] &= np.repeat(epoch - last_epoch < patience, restarts)
+            if epoch == prune_epoch and prune_ratio > 0:
+                # prune the worse candidates of each image
+                keep = max(1, restarts - int(restarts * prune_ratio))
+                pruned = np.argsort(candidate_loss, axis=1)[:, keep:] + offsets[:, np.newaxis]
+                alive[pruned.ravel()] = False
+
+            if on_snapshot is not None and epoch % break_time == 0:
+                best = np.argmin(candidate_loss, axis=1) + offsets
+                images = self.sess.run(self.images, feed_dict={self.active: best})
+                on_snapshot(epoch, image_loss, images)
+                if debug_graph:
+                    GAN.check_graph(self.graph, self.op_count, "repair epoch {}".format(epoch))
+
+        # the noise with least loss of each image
+        best = np.argmin(best_loss[:n * restarts].reshape(n, restarts), axis=1) + offsets
+        self.sess.run(self.load_noise, feed_dict={self.noise_holder: best_noise})
+        images = self.sess.run(self.images, feed_dict={self.active: best})
+        if self.noise_index is not None and index_learn:
+            self.noise_index.add(best_noise[best], images[1])
+        return images, best_loss[best]
+
+    def close(self):
+        self.sess.close()
+
+
+def save_repaired(writer, names, images, epoch=None):
+    """
+    save the repaired images, the image to repair ('xxx_init.jpg') is only saved with the final result
+    :param writer: the 'image_util.ImageWriter' to write images in background
+    :param names: the names of images prepared to repair, without extension
+    :param images: the images calculated by 'get_images', the range is [0, 1]
+    :param epoch: the epoch of snapshot, None for the final result
+    :return:
+    """
+    suffix = '' if epoch is None else '_{}'.format(epoch)
+    repaired_img, generate_img, init_img = images
+    for i, name in enumerate(names):
+        # reflect the value from [0,1] to [0,255]
+        writer.write(image_util.repair_path + '{}{}_repair.jpg'.format(name, suffix), repaired_img[i] * 255)
+        writer.write(image_util.repair_path + '{}{}_generate.jpg'.format(name, suffix), generate_img[i] * 255)
+        if epoch is None:
+            writer.write(image_util.repair_path + '{}_init.jpg'.format(name), init_img[i] * 255)
+
+
+def get_tiles(mask, stride):
+    """
+    get the windows with shape [image_height, image_width] which intersect the area prepared to repair. The windows
+    are placed every 'stride' pixels and the last ones are aligned with the border, so every pixel is covered.
+    :param mask: the mask of a large image, with shape [height, width, image_depth]
+    :param stride: the distance between windows, should be less than the size of window so they overlap
+    :return:
+     tiles: a list of (top, left) of windows
+    """
+    height, width = mask.shape[:2]
+    if height < GAN.image_height or width < GAN.image_width:
+        raise ValueError("image {}x{} is smaller than a tile".format(height, width))
+    tops = sorted(set(list(range(0, height - GAN.image_height, stride)) + [height - GAN.image_height]))
+    lefts = sorted(set(list(range(0, width - GAN.image_width, stride)) + [width - GAN.image_width]))
+    # the sum of mask in each window is read from the integral image
+    integral = np.pad(mask[:, :, 0].cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)), mode='constant')
+    tops, lefts = np.meshgrid(tops, lefts, indexing='ij')
+    bottoms, rights = tops + GAN.image_height, lefts + GAN.image_width
+    sums = integral[bottoms, rights] - integral[tops, rights] - integral[bottoms, lefts] + integral[tops, lefts]
+    return [(int(top), int(left)) for top, left in zip(tops[sums > 0], lefts[sums > 0])]
+
+
+def repair_tiled(repairer, img, mask, stride):
+    """
+    repair an image larger than [image_height, image_width]. it's divided into overlapping windows, only the windows
+    intersecting the mask are repaired, together in batches. the repaired windows are blended with weights decreasing
+    to their borders, and only the area prepared to repair is replaced.
+    :param repairer: the 'Repairer'
+    :param img: the image prepared to repair, with shape [height, width, image_depth], the range is [-1, 1]
+    :param mask: the mask of img, with the same shape
+    :param stride: the distance between windows
+    :return:
+     repaired_img: the repaired image, the range is [0, 1]
+     loss: the loss of each window
+    """
+    tiles = get_tiles(mask, stride)
+    # the weight of a pixel in a window is its distance to the border of window
+    ramp_y = np.minimum(np.arange(1, GAN.image_height + 1), np.arange(GAN.image_height, 0, -1))
+    ramp_x = np.minimum(np.arange(1, GAN.image_width + 1), np.arange(GAN.image_width, 0, -1))
+    weight = np.outer(ramp_y, ramp_x)[:, :, np.newaxis].astype(np.float64)
+
+    blend = np.zeros(img.shape, dtype=np.float64)
+    weight_sum = np.zeros(img.shape, dtype=np.float64)
+    losses = []
+    for begin in range(0, len(tiles), repairer.batch):
+        batch_tiles = tiles[begin: begin + repairer.batch]
+        windows = [(slice(top, top + GAN.image_height), slice(left, left + GAN.image_width))
+                   for top, left in batch_tiles]
+        (repaired, _, _), loss = repairer.repair(np.array([img[each] for each in windows]),
+                                                 np.array([mask[each] for each in windows]))
+        losses.extend(loss)
+        for each, repaired_tile in zip(windows, repaired):
+            blend[each] += repaired_tile * weight
+            weight_sum[each] += weight
+
+    repaired_img = (img + 1) / 2
+    covered = weight_sum > 0
+    blend[covered] /= weight_sum[covered]
+    repaired_img = np.where(mask > 0, blend, repaired_img)
+    return repaired_img, np.array(losses)
+
+
+def get_model_index():
+    """
+    the index of model used for repairing, the best one scored in training if 'model_index' is 'best'
+    :return:
+     index: the index of model
+    """
+    if model_index != 'best':
+        return int(model_index)
+    index, scores = evaluate.best_model(GAN.log_path, image_util.model_path)
+    if index is None:
+        raise ValueError("no saved model is scored in {}".format(GAN.log_path))
+    print("model-{} is the best, {}: {:.4g}".format(index, evaluate.eval_metric, scores[evaluate.eval_metric]))
+    return index
+
+
+def get_noise_index(index):
+    """
+    load the index of noises given by 'index_path'
+    :param index: the index of model used for repairing, the noises in the index must come from it
+    :return:
+     noise_index: the 'latent_index.LatentIndex', None if 'index_path' is empty or the index is built from another
+                  model
+    """
+    if not index_path:
+        return None
+    model = checkpoint.model_fingerprint(image_util.model_path + 'model-{}'.format(index))
+    return latent_index.load(index_path, GAN.noise_size, index_thumb, index_max, model)
+
+
+def repair(paths=None):
+    """
+    do repairing, the images are repaired 'batch_size' at a time. the results are saved in 'repair_path' with the name
+    of each image (see 'image_util.get_result_names'). if 'tiled' is set, the images could be larger than
+    [image_height, image_width], see 'repair_tiled'.
+    :param paths: the paths of images prepared to repair, the images given by 'target_path' by default
+    :return:
+    """
+    if paths is None:
+        paths = image_util.get_target_paths(image_util.target_path)
+    result_names = image_util.get_result_names(paths)
+    index = get_model_index()
+    noise_index = get_noise_index(index)
+    repairer = Repairer(batch_size, index, noise_index)
+    os.makedirs(image_util.repair_path, exist_ok=True)
+    writer = image_util.ImageWriter()
+    try:
+        if tiled:
+            # the images could be larger than [image_height, image_width], they are repaired one by one in tiles
+            for path, name in zip(paths, result_names):
+                img = image_util.get_target_img(path)
+                img_mask = image_util.get_target_mask(path, mask, img.shape[:2])
+                repaired_img, loss = repair_tiled(repairer, img, img_mask, tile_stride)
+                print("{} repaired in {} tiles, loss:{}".format(name, len(loss), loss.sum()))
+                writer.write(image_util.repair_path + '{}_repair.jpg'.format(name), repaired_img * 255)
+                writer.write(image_util.repair_path + '{}_init.jpg'.format(name), (img + 1) / 2 * (1 - img_mask) * 255)
+            return
+        for begin in range(0, len(paths), batch_size):
+            batch_paths = paths[begin: begin + batch_size]
+            names = result_names[begin: begin + batch_size]
+            imgs = [image_util.get_target_img(path) for path in batch_paths]
+            masks = [image_util.get_target_mask(path, mask) for path in batch_paths]
+
+            def on_snapshot(epoch, loss, images):
+                print("{} in {}, loss:{}".format(names, epoch, loss))
+                save_repaired(writer, names, images, epoch)
+
+            images, loss = repairer.repair(np.array(imgs), np.array(masks), on_snapshot)
+            print("{} repaired, loss:{}".format(names, loss))
+            save_repaired(writer, names, images)
+    finally:
+        try:
+            repairer.close()
+        finally:
+            try:
+                writer.close()
+            finally:
+                # the noises found are kept even if repairing is broken
+                if noise_index is not None and index_learn:
+                    noise_index.save(index_path)
+
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    cli.main(['repair'] + sys.argv[1:])
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import cv2
+import tensorflow as tf
+import cly_dcgan as GAN
+import image_util
+import checkpoint
+import config
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global frozen_path, sample_path, batch_size, shard_size, seed, folded
+    frozen_path = cfg.get('sample', 'frozen_path')
+    sample_path = cfg.get('sample', 'sample_path')
+    batch_size = cfg.getint('sample', 'batch_size')
+    shard_size = cfg.getint('sample', 'shard_size')
+    seed = cfg.getint('sample', 'seed')
+    folded = cfg.getboolean('sample', 'folded')
+
+
+def export(index, path=None, fold=None):
+    """
+    freeze G of a model to a graph only for inference: the variables are replaced with constants, and BN uses the
+    moving mean and variance (training=False). D and the optimizers are not included. If 'fold' is set, BN is folded
+    into the layers before it (see 'GAN.fold_generator'), and the outputs are checked with the unfolded G.
+    the input of graph is 'noise:0' with shape [?, noise_size], the output is 'samples:0' whose range is [-1, 1], and
+    'model:0' is the fingerprint of model (see 'checkpoint.model_fingerprint')
+    :param index: the index of model to export
+    :param path: the path of frozen graph, it's 'frozen_path' by default
+    :param fold: boolean, fold BN or not, it's 'folded' by default
+    :return:
+    """
+    fold = folded if fold is None else fold
+    model_file = image_util.model_path + 'model-{}'.format(index)
+    fingerprint = checkpoint.model_fingerprint(model_file)
+    with tf.Graph().as_default() as graph:
+        noise = tf.placeholder(tf.float32, [None, GAN.noise_size], name='noise')
+        outputs = GAN.get_generator(noise, False, False)
+        saver = tf.train.Saver(tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='generator'))
+        with tf.Session() as sess:
+            saver.restore(sess, model_file)
+            if fold:
+                with tf.Graph().as_default() as folded_graph:
+                    folded_noise = tf.placeholder(tf.float32, [None, GAN.noise_size], name='noise')
+                    folded_outputs = GAN.get_folded_generator(folded_noise, GAN.fold_generator(model_file))
+                    folded_outputs = tf.identity(folded_outputs, name='samples')
+                    tf.constant(fingerprint, name='model')
+                    with tf.Session() as folded_sess:
+                        batch_noise = np.random.uniform(-1, 1, size=(64, GAN.noise_size))
+                        error = np.abs(sess.run(outputs, feed_dict={noise: batch_noise}) -
+                                       folded_sess.run(folded_outputs, feed_dict={folded_noise: batch_noise})).max()
+                if error > 1e-3:
+                    raise ValueError("the outputs of folded G differ from G by {}".format(error))
+                print("BN is folded, the max difference of outputs is {}".format(error))
+                frozen = folded_graph.as_graph_def()
+            else:
+                tf.identity(outputs, name='samples')
+                tf.constant(fingerprint, name='model')
+                frozen = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), ['samples', 'model'])
+    with tf.gfile.GFile(path or frozen_path, 'wb') as f:
+        f.write(frozen.SerializeToString())
+    print("model-{} is exported to {}".format(index, path or frozen_path))
+
+
+def load_frozen(path=None):
+    """
+    load the frozen graph of G
+    :param path: the path of frozen graph, it's 'frozen_path' by default
+    :return:
+     sess: the session of frozen graph
+     noise: the input of G
+     samples: the output of G
+    """
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path or frozen_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    graph.finalize()
+    sess = tf.Session(graph=graph, config=GAN.get_session_config())
+    return sess, graph.get_tensor_by_name('noise:0'), graph.get_tensor_by_name('samples:0')
+
+
+def sample(num, out=None, batch=None, shard=None, random_seed=None, jpg=False):
+    """
+    generate lots of images with the frozen G, and stream them to disk in shards. the shards are saved in the format
+    of packed dataset (see 'image_util.load_dataset'), so they could be used as train data by 'dataset_path'.
+    :param num: the number of images to generate
+    :param out: the directory to save the shards, it's 'sample_path' by default
+    :param batch: the number of images generated in each run
+    :param shard: the number of images in each shard
+    :param random_seed: the seed of noise, the same seed gives the same images
+    :param jpg: save the images as jpg in a directory for each shard, instead of .npy
+    :return:
+    """
+    out = out or sample_path
+    batch = batch or batch_size
+    shard = shard or shard_size
+    random_seed = seed if random_seed is None else random_seed
+    random = np.random.RandomState(random_seed)
+    os.makedirs(out, exist_ok=True)
+
+    sess, noise, samples = load_frozen()
+    shards = []
+    try:
+        for begin in range(0, num, shard):
+            count = min(shard, num - begin)
+            name = 'shard-{:05d}'.format(len(shards))
+            if jpg:
+                os.makedirs(os.path.join(out, name), exist_ok=True)
+            else:
+                imgs = np.lib.format.open_memmap(os.path.join(out, name + '.npy'), mode='w+', dtype=np.uint8,
+                                                 shape=(count, GAN.image_height, GAN.image_width, GAN.image_depth))
+            for i in range(0, count, batch):
+                batch_noise = random.uniform(-1, 1, size=(min(batch, count - i), GAN.noise_size))
+                batch_imgs = sess.run(samples, feed_dict={noise: batch_noise})
+                # [-1, 1] to [0, 255]
+                batch_imgs = np.clip(np.rint((batch_imgs + 1) * 127.5), 0, 255).astype(np.uint8)
+                if jpg:
+                    for j, img in enumerate(batch_imgs):
+                        cv2.imwrite(os.path.join(out, name, '{}.jpg'.format(begin + i + j)), img)
+                else:
+                    imgs[i: i + len(batch_imgs)] = batch_imgs
+            if not jpg:
+                imgs.flush()
+                del imgs
+            shards.append({'file': name + ('' if jpg else '.npy'), 'count': count})
+            print("{} images are generated".format(begin + count))
+    finally:
+        sess.close()
+    if not jpg:
+        image_util.write_manifest(out, {'fingerprint': {'source': 'sample', 'seed': random_seed},
+                                        'shards': shards})
+
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    # 'python sample.py export ...' and 'python sample.py sample ...'
+    cli.main(sys.argv[1:])
@@ -0,0 +1,323 @@
+"""
+A repair service for other programs: G is restored only once, and the images posted by clients at about the same time
+are repaired together in one batch. A batch is run once 'max_batch' images are waiting, or 'max_wait' seconds after
+the first one arrived.
+    POST /repair  {"image": base64 of a jpg/png image, "mask": base64 of a mask image, or regions described as 'mask'
+                   in [repair] (optional, 'mask' in [repair] by default)}
+                  -> {"image": base64 of the repaired png image, "loss": the loss of repaired image}
+    GET /stats    -> the number of images waiting, the batches run, and the percentiles of latency
+"""
+import json
+import time
+import queue
+import base64
+import threading
+import collections
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import cv2
+import config
+import image_util
+
+
+@config.register
+def configure(cfg):
+    """
+    read the settings of this module, see 'config.use'
+    :param cfg: the 'config.Config'
+    :return:
+    """
+    global host, port, max_batch, max_wait, latency_window
+    host = cfg.get('server', 'host')
+    port = cfg.getint('server', 'port')
+    max_batch = cfg.getint('server', 'max_batch')
+    max_wait = cfg.getfloat('server', 'max_wait')
+    latency_window = cfg.getint('server', 'latency_window')
+
+
+class Job(object):
+    """
+    an image waiting to be repaired, 'done' is set once 'result' or 'error' is given
+    """
+
+    def __init__(self, img, mask):
+        self.img = img
+        self.mask = mask
+        self.begin = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.loss = None
+        self.error = None
+
+
+class BatchRepairer(object):
+    """
+    repair the images submitted by several threads in batches, with one 'repair.Repairer' in a thread
+    """
+
+    def __init__(self, repairer, batch=None, wait=None, window=None):
+        """
+        :param repairer: the 'repair.Repairer', it could repair 'batch' images together
+        :param batch: the most number of images in a batch, it's 'max_batch' by default
+        :param wait: the most seconds the first image in a batch waits for others, it's 'max_wait' by default
+        :param window: the number of latest images whose latency is counted in 'stats', it's 'latency_window' by
+                       default
+        """
+        self.repairer = repairer
+        self.batch = batch or max_batch
+        self.wait = max_wait if wait is None else wait
+        if self.batch > repairer.batch:
+            raise ValueError("batch {} is larger than the repairer's {}".format(self.batch, repairer.batch))
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window or latency_window)
+        self.waits = collections.deque(maxlen=window or latency_window)
+        self.batch_sizes = collections.Counter()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, img, mask):
+        """
+        add an image to the queue
+        :param img: the image prepared to repair, with shape [image_height, image_width, image_depth], the range is
+                    [-1, 1]
+        :param mask: the mask of img, with the same shape
+        :return:
+         job: the 'Job', wait for 'job.done' to read its result
+        """
+        job = Job(img, mask)
+        self.jobs.put(job)
+        return job
+
+    def repair(self, img, mask):
+        """
+        repair an image and wait for the result
+        :return:
+         repaired_img: the repaired image, the range is [0, 1]
+         loss: the loss of repaired image
+        """
+        job = self.submit(img, mask)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result, job.loss
+
+    def _next_batch(self):
+        """
+        wait for the first job, then collect more jobs until the batch is full or 'wait' seconds passed
+        :return:
+         jobs: a list of jobs, empty if it's closed
+        """
+        job = self.jobs.get()
+        if job is None:
+            return []
+        jobs = [job]
+        deadline = time.time() + self.wait
+        while len(jobs) < self.batch:
+            try:
+                job = self.jobs.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if job is None:
+                # stop after this batch
+                self.jobs.put(None)
+                break
+            jobs.append(job)
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._next_batch()
+            if not jobs:
+                break
+            start = time.time()
+            with self.lock:
+                self.in_flight = len(jobs)
+            try:
+                (repaired, _, _), loss = self.repairer.repair(np.array([job.img for job in jobs]),
+                                                              np.array([job.mask for job in jobs]))
+                for job, repaired_img, each_loss in zip(jobs, repaired, loss):
+                    job.result, job.loss = repaired_img, float(each_loss)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            end = time.time()
+            with self.lock:
+                self.in_flight = 0
+                self.batch_sizes[len(jobs)] += 1
+                for job in jobs:
+                    self.latencies.append(end - job.begin)
+                    self.waits.append(start - job.begin)
+                    if job.error is None:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+            for job in jobs:
+                job.done.set()
+
+    def stats(self):
+        """
+        :return:
+         a dict of the number of images waiting and being repaired, the number of images and batches done, and the
+         percentiles of latency (seconds from submitting to the result) and of waiting (seconds in queue)
+        """
+        with self.lock:
+            latencies, waits = np.array(self.latencies), np.array(self.waits)
+            batches = sum(self.batch_sizes.values())
+            images = sum(size * count for size, count in self.batch_sizes.items())
+            stats = {'queue_depth': self.jobs.qsize(), 'in_flight': self.in_flight, 'completed': self.completed,
+                     'failed': self.failed, 'batches': batches, 'mean_batch': images / batches if batches else 0.0}
+        for name, values in [('latency', latencies), ('wait', waits)]:
+            stats[name] = {'p{}'.format(q): float(np.percentile(values, q)) if len(values) else None
+                           for q in (50, 90, 99)}
+        return stats
+
+    def close(self):
+        """
+        repair the images in queue and stop
+        :return:
+        """
+        self.jobs.put(None)
+        self.thread.join()
+
+
+def decode_image(data, flags=cv2.IMREAD_COLOR):
+    """
+    :param data: base64 of an encoded image
+    :param flags: the flags of 'cv2.imdecode'
+    :return:
+     img: uint8 array
+    """
+    img = cv2.imdecode(np.frombuffer(base64.b64decode(data), dtype=np.uint8), flags)
+    if img is None:
+        raise ValueError("can't decode image")
+    return img
+
+
+def parse_request(body, default_mask):
+    """
+    get the image and mask from the body of a request to '/repair'
+    :param body: the json body
+    :param default_mask: the mask used if no mask is given
+    :return:
+     img: the image prepared to repair, the range is [-1, 1]
+     mask: the mask of img
+    """
+    request = json.loads(body.decode('utf-8'))
+    img = decode_image(request['image'])
+    if img.shape != (image_util.image_height, image_util.image_width, image_util.image_depth):
+        raise ValueError("image should be {}x{}, not {}x{}".format(image_util.image_height, image_util.image_width,
+                                                                   img.shape[0], img.shape[1]))
+    mask = request.get('mask')
+    if not mask:
+        mask = default_mask
+    elif mask.split()[0] in ('rect', 'poly'):
+        mask = image_util.get_mask(mask)
+    else:
+        mask = decode_image(mask, cv2.IMREAD_GRAYSCALE)
+        mask = cv2.resize(mask, (image_util.image_width, image_util.image_height), interpolation=cv2.INTER_NEAREST)
+        mask = np.repeat((mask > 127)[:, :, np.newaxis], image_util.image_depth, axis=2).astype(np.float32)
+    return img / 255 * 2 - 1, mask
+
+
+class RepairHandler(BaseHTTPRequestHandler):
+    """
+    the handler of requests, 'server.service' is the 'BatchRepairer' and 'server.default_mask' is the default mask
+    """
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.service.stats())
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/repair':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            img, mask = parse_request(body, self.server.default_mask)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            repaired_img, loss = self.server.service.repair(img, mask)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        _, data = cv2.imencode('.png', np.clip(np.rint(repaired_img * 255), 0, 255).astype(np.uint8))
+        self.send_json(200, {'image': base64.b64encode(data.tobytes()).decode('ascii'), 'loss': loss})
+
+    def log_message(self, format, *args):
+        # the requests are counted in '/stats' instead
+        pass
+
+
+def request_repair(img_data, mask=None, url=None, timeout=None):
+    """
+    repair an image by the service
+    :param img_data: the bytes of a jpg/png image
+    :param mask: the bytes of a mask image, or regions described as 'mask' in [repair], the default of service if None
+    :param url: the url of service, 'http://host:port' by default
+    :param timeout: the most seconds to wait
+    :return:
+     img_data: the bytes of repaired png image
+     loss: the loss of repaired image
+    """
+    request = {'image': base64.b64encode(img_data).decode('ascii')}
+    if isinstance(mask, bytes):
+        request['mask'] = base64.b64encode(mask).decode('ascii')
+    elif mask is not None:
+        request['mask'] = mask
+    url = url or 'http://{}:{}'.format(host, port)
+    req = urllib.request.Request(url + '/repair', data=json.dumps(request).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        result = json.loads(response.read().decode('utf-8'))
+    return base64.b64decode(result['image']), result['loss']
+
+
+def serve():
+    """
+    restore G of 'model_index' (see [repair]) and serve on 'host':'port' until interrupted
+    :return:
+    """
+    import repair
+    index = repair.get_model_index()
+    noise_index = repair.get_noise_index(index)
+    repairer = repair.Repairer(max_batch, index, noise_index)
+    service = BatchRepairer(repairer)
+    httpd = ThreadingHTTPServer((host, port), RepairHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    httpd.default_mask = image_util.get_mask(repair.mask)
+    print("repairing on http://{}:{}, at most {} images in {}s a batch".format(host, port, max_batch, max_wait))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+        repairer.close()
+        if noise_index is not None and repair.index_learn:
+            noise_index.save(repair.index_path)
+
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    cli.main(['serve'] + sys.argv[1:])
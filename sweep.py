@@ -0,0 +1,205 @@
+"""
+Train with several configurations at the same time, e.g.
+    python cli.py sweep --grid train.learning_rate=0.001,0.0002 --grid train.beta1=0.4,0.5 --workers 2
+The runs are trained in a pool of processes, each one saves its models, images, metrics and config in its own
+directory under '--out'. The dataset is packed and copied to shared memory only once, all runs read the same copy.
+The statistics of the dataset for scoring are computed once too, and saved in '--out'.
+A table of the final losses, the last scores of G (if 'eval_every' is set, see 'evaluate.py') and the throughput of
+each run is printed and saved as 'summary.json'.
+"""
+import os
+import json
+import time
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import config
+import image_util
+import evaluate
+
+
+def get_runs(grid=(), runs_path=None):
+    """
+    get the settings of each run
+    :param grid: a list of 'section.key=value1,value2,...', every combination of the values is a run
+    :param runs_path: a json file with a list of runs, each one is a dict of {"section.key": value}
+    :return:
+     runs: a list of runs, each one is a list of (section, key, value)
+    """
+    import cli
+    runs = []
+    if grid:
+        axes = [[(section, key, each.strip()) for each in value.split(',')]
+                for section, key, value in cli.parse_settings(grid)]
+        runs.extend(list(run) for run in itertools.product(*axes))
+    if runs_path is not None:
+        with open(runs_path) as f:
+            for run in json.load(f):
+                runs.append(cli.parse_settings(['{}={}'.format(name, value) for name, value in run.items()]))
+    return runs
+
+
+def share_dataset(dataset):
+    """
+    copy the dataset to a block of shared memory
+    :param dataset: the 'image_util.Dataset'
+    :return:
+     shm: the 'SharedMemory', it should be unlinked after use
+     shape: the shape of images in it
+    """
+    shape = (len(dataset),) + dataset.shards[0].shape[1:]
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    imgs = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    for shard, offset in zip(dataset.shards, dataset.offsets):
+        imgs[offset: offset + len(shard)] = shard
+    del imgs
+    return shm, shape
+
+
+def read_metrics(log_dir):
+    """
+    :param log_dir: the log directory of a run
+    :return:
+     the losses of the last epoch, the mean throughput of the epochs (the first one warms up, so it's not counted if
+     there are more), and the scores of the last evaluation (see 'evaluate.py') if any
+    """
+    with open(os.path.join(log_dir, 'metrics.jsonl')) as f:
+        records = [json.loads(line) for line in f]
+    epochs = [record for record in records if record['type'] == 'epoch']
+    evals = [record for record in records if record['type'] == 'eval']
+    if not epochs:
+        return {}
+    counted = epochs[1:] or epochs
+    result = {'epochs': len(epochs), 'g_loss': epochs[-1].get('g_loss'), 'd_loss': epochs[-1].get('d_loss'),
+              'images_per_sec': float(np.mean([record['images_per_sec'] for record in counted]))}
+    if evals:
+        result.update(frechet=evals[-1]['frechet'], hist_tv=evals[-1]['hist_tv'])
+    return result
+
+
+def train_run(args):
+    """
+    train a run in a worker process
+    :param args: (name, sections, shm_name, shape, reference_path), sections is the config as a dict of dicts, and
+                 reference_path is the statistics of dataset saved by 'evaluate.get_reference', or None
+    :return:
+     result: a dict of the name, the seconds spent, the metrics ('read_metrics') and the error if it failed
+    """
+    name, sections, shm_name, shape, reference_path = args
+    cfg = config.Config()
+    cfg.read_dict(sections)
+    config.use(cfg)
+    begin = time.time()
+    result = {'name': name}
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        imgs = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        imgs.flags.writeable = False
+        import tensorflow as tf
+        import cly_dcgan as GAN
+        reference = evaluate.ImageStats.load(reference_path) if reference_path else None
+        with tf.Graph().as_default():
+            GAN.train(image_util.Dataset([imgs]), reference)
+        result.update(read_metrics(GAN.log_path))
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        # the views of shared memory must be released before closing it
+        imgs = None
+        shm.close()
+    result['seconds'] = time.time() - begin
+    return result
+
+
+def print_summary(runs, results):
+    """
+    print a table of the settings and results of runs
+    :param runs: the settings of runs given by 'get_runs'
+    :param results: the results given by 'train_run'
+    :return:
+    """
+    names = sorted({'{}.{}'.format(section, key) for run in runs for section, key, _ in run})
+    header = ['run'] + names + ['g_loss', 'd_loss', 'frechet', 'hist_tv', 'images/s', 'seconds']
+    rows = []
+    for run, result in zip(runs, results):
+        values = {'{}.{}'.format(section, key): value for section, key, value in run}
+        row = [result['name']] + [values.get(name, '') for name in names]
+        if 'error' in result:
+            row += [result['error'], '', '', '', '', '{:.0f}'.format(result['seconds'])]
+        else:
+            row += ['{:.4g}'.format(result[key]) if result.get(key) is not None else ''
+                    for key in ('g_loss', 'd_loss', 'frechet', 'hist_tv', 'images_per_sec')]
+            row.append('{:.0f}'.format(result['seconds']))
+        rows.append(row)
+    widths = [max(len(str(row[i])) for row in [header] + rows) + 2 for i in range(len(header))]
+    for row in [header] + rows:
+        print(''.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def sweep(runs, out='./sweep/', workers=2):
+    """
+    train the runs concurrently
+    :param runs: the settings of runs given by 'get_runs', they override the config in use ('config.current')
+    :param out: the directory of runs, each run saves everything in 'out/run-xxx/'
+    :param workers: the number of runs trained at the same time
+    :return:
+     results: the results of runs, see 'train_run'
+    """
+    base = config.current
+    dataset = image_util.get_dataset(base.getint('image', 'image_num'))
+
+    configs = []
+    for run in runs:
+        cfg = config.Config()
+        cfg.read_dict({section: dict(base[section]) for section in base.sections()})
+        for section, key, value in run:
+            if not cfg.has_option(section, key):
+                raise ValueError("unknown setting {}.{}".format(section, key))
+            cfg.set(section, key, value)
+        configs.append(cfg)
+
+    # the statistics for scoring depend only on the dataset and the bins, so they are computed once for each number
+    # of bins, instead of in every run
+    os.makedirs(out, exist_ok=True)
+    reference_paths = {}
+    for cfg in configs:
+        bins = cfg.getint('train', 'eval_bins')
+        if cfg.getint('train', 'eval_every') > 0 and bins not in reference_paths:
+            reference_paths[bins] = os.path.join(out, 'train_stats-{}.npz'.format(bins))
+            evaluate.get_reference(dataset, reference_paths[bins], cfg.getint('train', 'eval_chunk'), bins)
+
+    shm, shape = share_dataset(dataset)
+    del dataset
+    print("{} images are shared by {} runs".format(shape[0], len(runs)))
+
+    tasks = []
+    for i, cfg in enumerate(configs):
+        name = 'run-{:03d}'.format(i)
+        run_dir = os.path.join(out, name)
+        for key in ('model_path', 'result_path', 'repair_path', 'log_path'):
+            path = os.path.join(run_dir, key[:-len('_path')], '')
+            os.makedirs(path, exist_ok=True)
+            cfg.set('file', key, path)
+        # the runs share the cores, unless the threads are given
+        if cfg.getint('train', 'intra_op_threads') == 0:
+            cfg.set('train', 'intra_op_threads', str(max(1, os.cpu_count() // workers)))
+        with open(os.path.join(run_dir, 'net.cfg'), 'w') as f:
+            cfg.write(f)
+        tasks.append((name, {section: dict(cfg[section]) for section in cfg.sections()}, shm.name, shape,
+                      reference_paths.get(cfg.getint('train', 'eval_bins'))))
+
+    try:
+        # a new process for each run, so the memory of TensorFlow is released after it. the processes are spawned
+        # instead of forked, so they are not affected by the threads of parent
+        with multiprocessing.get_context('spawn').Pool(workers, maxtasksperchild=1) as pool:
+            results = pool.map(train_run, tasks, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    with open(os.path.join(out, 'summary.json'), 'w') as f:
+        json.dump([dict(result, settings={'{}.{}'.format(section, key): value for section, key, value in run})
+                   for run, result in zip(runs, results)], f, indent=1)
+    print_summary(runs, results)
+    return results
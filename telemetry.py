@@ -0,0 +1,112 @@
+import os
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import tensorflow as tf
+
+
+class Telemetry(object):
+    """
+    record the time spent in each phase (loading data, optimizing, sampling, writing, saving...), the losses and the
+    throughput, for each step and each epoch. They are saved to TensorBoard event files and to 'metrics.jsonl' (one
+    json object each line) in the log directory.
+    """
+
+    def __init__(self, log_dir, print_every):
+        """
+        :param log_dir: the directory for saving event files and 'metrics.jsonl'
+        :param print_every: print the progress at most once in 'print_every' seconds
+        """
+        os.makedirs(log_dir, exist_ok=True)
+        self.log = open(os.path.join(log_dir, 'metrics.jsonl'), 'a')
+        self.summary_writer = tf.summary.FileWriter(log_dir)
+        self.print_every = print_every
+        self.last_print = 0
+        self.step_times = defaultdict(float)
+        self.epoch_times = defaultdict(float)
+        self.epoch_images = 0
+        self.epoch_begin = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        time a phase, e.g. 'with telemetry.phase("data"):'
+        :param name: the name of phase
+        :return:
+        """
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.step_times[name] += time.time() - begin
+
+    def end_step(self, step, epoch, batch_i, images, **scalars):
+        """
+        record a step, the time of phases since last step is included
+        :param step: the global step
+        :param epoch: the epoch of step
+        :param batch_i: the index of batch in epoch
+        :param images: the number of images trained in step
+        :param scalars: the values to record, e.g. losses. None is ignored
+        :return:
+        """
+        seconds = sum(self.step_times.values())
+        scalars = {key: float(value) for key, value in scalars.items() if value is not None}
+        scalars['images_per_sec'] = images / seconds if seconds > 0 else 0.0
+        self.write('step', step, epoch=epoch, batch=batch_i, scalars=scalars, times=self.step_times)
+
+        for name, value in self.step_times.items():
+            self.epoch_times[name] += value
+        self.step_times = defaultdict(float)
+        self.epoch_images += images
+
+        if time.time() - self.last_print >= self.print_every:
+            self.last_print = time.time()
+            print("training in (epoch = {}, batch = {}) {}".format(
+                epoch, batch_i, ', '.join('{}: {:.4g}'.format(key, value) for key, value in sorted(scalars.items()))))
+
+    def end_epoch(self, epoch, **scalars):
+        """
+        record an epoch, the phases out of steps (sampling, writing, saving...) are included
+        :param epoch: the epoch
+        :param scalars: the values to record, e.g. losses. None is ignored
+        :return:
+        """
+        for name, value in self.step_times.items():
+            self.epoch_times[name] += value
+        seconds = time.time() - self.epoch_begin
+        scalars = {key: float(value) for key, value in scalars.items() if value is not None}
+        scalars['images_per_sec'] = self.epoch_images / seconds if seconds > 0 else 0.0
+        self.write('epoch', epoch, scalars=scalars, times=self.epoch_times)
+        print("epoch {} finished in {:.1f}s, {}".format(
+            epoch, seconds, ', '.join('{}: {:.4g}'.format(key, value) for key, value in sorted(scalars.items()))))
+
+        self.step_times = defaultdict(float)
+        self.epoch_times = defaultdict(float)
+        self.epoch_images = 0
+        self.epoch_begin = time.time()
+
+    def write(self, kind, step, scalars, times=None, **fields):
+        """
+        save a record to 'metrics.jsonl' and TensorBoard, the tags in TensorBoard are 'kind/name'
+        :param kind: the kind of record, e.g. 'step' or 'epoch'
+        :param step: the x-axis value in TensorBoard
+        :param scalars: a dict of values
+        :param times: a dict of seconds spent in each phase
+        :param fields: other values only saved to 'metrics.jsonl'
+        :return:
+        """
+        record = dict(fields, type=kind, step=step, wall_time=time.time(), **scalars)
+        values = [tf.Summary.Value(tag='{}/{}'.format(kind, key), simple_value=value)
+                  for key, value in scalars.items()]
+        if times is not None:
+            record['time'] = dict(times)
+            values += [tf.Summary.Value(tag='{}_time/{}'.format(kind, key), simple_value=value)
+                       for key, value in times.items()]
+        self.log.write(json.dumps(record) + '\n')
+        self.summary_writer.add_summary(tf.Summary(value=values), step)
+
+    def close(self):
+        self.log.close()
+        self.summary_writer.close()